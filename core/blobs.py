@@ -0,0 +1,126 @@
+"""
+Reference counting for content-addressed media blobs (see core.storage).
+
+A blob is referenced by the file fields of Post, Profile and Message, and by
+the image variants stored in their JSON fields. Signals (core.signals) diff
+a row's references before and after each save, so refcounts follow uploads,
+replaced avatars/covers and deleted posts. Names that aren't blobs (files
+saved before content addressing, the static defaults) are simply not counted.
+
+Queryset .update() calls skip signals; code that changes references that way
+calls retain()/release() itself. `gc_media --recount` rebuilds every count
+from the tables if they ever drift.
+"""
+import os
+import time
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import MediaBlob, Message, Post, Profile
+from .storage import BLOB_DIR
+
+FILE_FIELDS = {
+    Post: ('image', 'video'),
+    Profile: ('profile_picture', 'cover_photo'),
+    Message: ('file',),
+}
+VARIANT_FIELDS = {
+    Post: ('image_variants',),
+    Profile: ('picture_variants', 'cover_variants'),
+    Message: (),
+}
+
+
+def variant_names(variants):
+    return [path for label, formats in (variants or {}).items() if label != 'source' for path in formats.values()]
+
+
+def _collect(values, model):
+    refs = Counter()
+    for field in FILE_FIELDS[model]:
+        name = values[field]
+        if name:
+            refs[str(name)] += 1
+    for field in VARIANT_FIELDS[model]:
+        refs.update(variant_names(values[field]))
+    return refs
+
+
+def tracked_fields(model):
+    return FILE_FIELDS[model] + VARIANT_FIELDS[model]
+
+
+def references(instance):
+    """Blob names (with multiplicity) this unsaved/just-saved instance points at."""
+    model = type(instance)
+    values = {field: getattr(instance, field) for field in FILE_FIELDS[model]}
+    values = {field: value.name if value else '' for field, value in values.items()}
+    values.update({field: getattr(instance, field) for field in VARIANT_FIELDS[model]})
+    return _collect(values, model)
+
+
+def stored_references(instance):
+    """References of the row as it is in the database (before a save)."""
+    model = type(instance)
+    if instance._state.adding or instance.pk is None:
+        return Counter()
+    values = model.objects.filter(pk=instance.pk).values(*tracked_fields(model)).first()
+    return _collect(values, model) if values else Counter()
+
+
+def _adjust(refs, sign):
+    by_count = {}
+    for name, count in refs.items():
+        by_count.setdefault(count, []).append(name)
+    for count, names in by_count.items():
+        MediaBlob.objects.filter(name__in=names).update(refcount=F('refcount') + sign * count)
+
+
+def retain(refs):
+    _adjust(Counter(refs), 1)
+
+
+def release(refs):
+    _adjust(Counter(refs), -1)
+
+
+def recount():
+    """Recompute every refcount from the tables; returns how many blobs are referenced."""
+    refs = Counter()
+    for model in FILE_FIELDS:
+        for values in model.objects.values(*tracked_fields(model)).iterator():
+            refs.update(_collect(values, model))
+    with transaction.atomic():
+        MediaBlob.objects.update(refcount=0)
+        retain(refs)
+    return MediaBlob.objects.filter(refcount__gt=0).count()
+
+
+def collect_garbage(grace, dry_run=False, storage=default_storage):
+    """
+    Delete blobs with no references that haven't been saved within `grace`
+    (a timedelta), plus temp files from interrupted saves. Returns (blobs, bytes).
+    """
+    cutoff = timezone.now() - grace
+    removed = freed = 0
+    for blob in MediaBlob.objects.filter(refcount__lte=0, stored_at__lt=cutoff).iterator():
+        if not dry_run:
+            # Re-checked in the DELETE in case the blob was referenced meanwhile
+            deleted, _ = MediaBlob.objects.filter(id=blob.id, refcount__lte=0, stored_at__lt=cutoff).delete()
+            if not deleted:
+                continue
+            storage.delete(blob.name)
+        removed += 1
+        freed += blob.size
+
+    tmp_dir = storage.path(f'{BLOB_DIR}/tmp')
+    if not dry_run and os.path.isdir(tmp_dir):
+        for entry in os.scandir(tmp_dir):
+            if entry.stat().st_mtime < time.time() - grace.total_seconds():
+                os.remove(entry.path)
+    return removed, freed
+
@@ -0,0 +1,247 @@
+"""
+Two-tier cache backend, plus helpers for the caches built on it.
+
+TieredCache (CACHES['default']) keeps a small in-process LRU in front of a
+backend every worker process shares (CACHES['shared']: Redis or a
+DatabaseCache table). Reads try the LRU first; writes and deletes go to both
+tiers. add() and incr() go straight to the shared backend, whose add() must
+be atomic: get_or_compute's locks and Namespace versions depend on it, so
+FileBasedCache (has_key, then set) won't do. Entries live at most
+LOCAL_TIMEOUT seconds in the LRU, which bounds how long another process can
+keep serving a value this one replaced or deleted.
+
+Helpers, all on the default cache:
+
+    get_or_set_many  one get_many for a batch of per-id keys, one call to
+                     compute the misses, one set_many to store them
+    Namespace        keys under a version kept in the cache; invalidate()
+                     drops every key in the namespace at once
+    get_or_compute   read-through without the stampede: the value carries a
+                     soft expiry, and once it passes one caller recomputes
+                     (holding a lock) while the rest keep the old value
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# LRUs by LOCATION; Django gives each thread its own backend instance, so the
+# data lives here to be shared by all of them (like LocMemCache does)
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        with _tiers_lock:
+            self._local, self._lock = _tiers.setdefault(name, (OrderedDict(), threading.Lock()))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    # In-process tier: {key: (expires_at, pickled value)}, least recently used first.
+    # Values are pickled so callers can't mutate what other callers get back.
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+        return entry
+
+    def _local_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self.local_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            if timeout <= 0:
+                self._local_delete(key)
+                return
+            ttl = min(ttl, timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, pickled)
+            self._local.move_to_end(key)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry = self._local_get(local_key)
+        if entry is not None:
+            return pickle.loads(entry[1])
+        missing = object()
+        value = self.shared.get(key, missing, version=version)
+        if value is missing:
+            return default
+        self._local_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, remote = {}, []
+        for key in keys:
+            entry = self._local_get(self.make_and_validate_key(key, version=version))
+            if entry is None:
+                remote.append(key)
+            else:
+                found[key] = pickle.loads(entry[1])
+        if remote:
+            fetched = self.shared.get_many(remote, version=version)
+            for key, value in fetched.items():
+                self._local_set(self.make_key(key, version=version), value)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout, version=version)
+        self._local_set(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        # Only the shared tier can say whether the key exists anywhere
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._local_set(local_key, value, timeout)
+        else:
+            self._local_delete(local_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.shared.incr(key, delta, version=version)
+        self._local_delete(local_key)
+        return value
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        return self._local_get(local_key) is not None or self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._local_delete(*(self.make_and_validate_key(key, version=version) for key in keys))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+
+def get_or_set_many(keys, compute, timeout=DEFAULT_TIMEOUT):
+    """
+    `keys` maps cache keys to items (ids, usually). compute(missing items)
+    must return {item: value} and is only called if something missed.
+    Returns {item: value} for every item.
+    """
+    found = cache.get_many(keys.keys())
+    result = {keys[key]: value for key, value in found.items()}
+    missing = [item for key, item in keys.items() if key not in found]
+    if missing:
+        computed = compute(missing)
+        key_for = {item: key for key, item in keys.items()}
+        cache.set_many({key_for[item]: value for item, value in computed.items()}, timeout)
+        result.update(computed)
+    return result
+
+
+class Namespace:
+    """
+    A group of keys that can be invalidated together, e.g.
+    Namespace(f'profile:{user_id}').key('summary'). The version lives in the
+    cache with no timeout; old entries are never deleted, just never read
+    again, and expire on their own.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = f'ns:{name}'
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Start from the clock, so a version that was evicted can't come back
+            # as a number whose old entries are still cached
+            version = time.time_ns()
+            if not cache.add(self.version_key, version, None):
+                version = cache.get(self.version_key, version)
+        return version
+
+    def key(self, key):
+        return f'{self.name}:{self.version()}:{key}'
+
+    def keys(self, keys):
+        """{namespaced key: key}, for get_or_set_many (one version lookup)."""
+        version = self.version()
+        return {f'{self.name}:{version}:{key}': key for key in keys}
+
+    def invalidate(self):
+        cache.set(self.version_key, time.time_ns(), None)
+
+
+def get_or_compute(key, compute, timeout, early=0.2, lock_timeout=30, wait=2):
+    """
+    Like cache.get_or_set(key, compute, timeout), but a popular key expiring
+    doesn't send every request to compute() at once.
+
+    The value is stored with a soft expiry `early` (a fraction of timeout)
+    before the real one. The first caller past it takes a lock and recomputes;
+    everyone else keeps getting the cached value meanwhile. On a cold miss
+    only the lock holder computes and the others wait up to `wait` seconds for
+    its result before computing it themselves. Keys written here hold
+    (value, refresh_at) pairs, so only read them through this function.
+    """
+    entry = cache.get(key)
+    lock_key = f'lock:{key}'
+    if entry is not None:
+        value, refresh_at = entry
+        if time.time() < refresh_at or not cache.add(lock_key, 1, lock_timeout):
+            return value
+    elif not cache.add(lock_key, 1, lock_timeout):
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        # The lock holder is slow or died; don't hold this request any longer
+        return _store(key, compute(), timeout, early)
+
+    try:
+        return _store(key, compute(), timeout, early)
+    finally:
+        cache.delete(lock_key)
+
+
+def _store(key, value, timeout, early):
+    cache.set(key, (value, time.time() + timeout * (1 - early)), timeout)
+    return value
@@ -0,0 +1,40 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Post
+
+COUNTER_FIELDS = ('like_count', 'comment_count', 'share_count')
+
+
+def bump(post_id, field, delta=1):
+    """Atomically add `delta` to one of the Post counters, never going below zero."""
+    Post.objects.filter(id=post_id).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def _count_subquery(queryset, key):
+    counts = queryset.filter(**{key: OuterRef('pk')}).order_by().values(key).annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recount_likes(post_id):
+    """Set like_count from the likes table in one UPDATE, for writes that can race each other."""
+    Post.objects.filter(id=post_id).update(like_count=_count_subquery(Post.likes.through.objects.all(), 'post_id'))
+
+
+def with_actual_counts(queryset):
+    """Annotate actual_likes / actual_comments / actual_shares from the source tables."""
+    return queryset.annotate(
+        actual_likes=_count_subquery(Post.likes.through.objects.all(), 'post_id'),
+        actual_comments=_count_subquery(Comment.objects.all(), 'post_id'),
+        actual_shares=_count_subquery(Post.objects.all(), 'shared_post_id'),
+    )
+
+
+def drifted_posts(queryset=None):
+    """Posts whose stored counters disagree with the source tables."""
+    queryset = with_actual_counts(queryset if queryset is not None else Post.objects.all())
+    return queryset.filter(
+        ~Q(like_count=F('actual_likes'))
+        | ~Q(comment_count=F('actual_comments'))
+        | ~Q(share_count=F('actual_shares'))
+    )
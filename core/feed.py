@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Comment, Post
+from .pagination import keyset_page
+
+FEED_PAGE_SIZE = 20
+COMMENT_PREVIEW_SIZE = 3
+
+
+def paginate_posts(queryset, cursor=None, limit=FEED_PAGE_SIZE):
+    """Keyset page of posts over (created_at, id); returns (posts, next_cursor)."""
+    return keyset_page(queryset, 'created_at', cursor=cursor, limit=limit)
+
+
+def home_feed_queryset(user):
+    # Public posts from everyone plus the viewer's own private posts. Phrased as
+    # an exclude so SQLite walks post_created_id_idx in order and stops after a
+    # page, instead of OR-ing two index lookups and sorting every match.
+    return with_card_relations(Post.objects.exclude(
+        Q(visibility='private') & ~Q(user=user)
+    ))
+
+
+def with_card_relations(queryset):
+    # Authors and shared-post authors (with profiles) come back in the same query
+    return queryset.select_related('user__profile', 'shared_post__user__profile')
+
+
+def hydrate_posts(posts, viewer, preview_size=COMMENT_PREVIEW_SIZE):
+    """
+    Attach the per-viewer bits a post card needs so templates never hit the
+    database: liked_by_me and comment_preview (the latest `preview_size`
+    comments, oldest first). Like/comment counts are columns on Post. Costs
+    two queries regardless of how many posts are passed in. Returns the
+    posts as a list.
+    """
+    posts = list(posts)
+    post_ids = [post.id for post in posts]
+    if not post_ids:
+        return posts
+
+    liked_ids = set(
+        Post.likes.through.objects.filter(post_id__in=post_ids, user_id=viewer.id)
+        .values_list('post_id', flat=True)
+    )
+
+    previews = defaultdict(list)
+    if preview_size:
+        latest = Comment.objects.filter(post_id__in=post_ids).annotate(
+            row=Window(
+                RowNumber(),
+                partition_by=[F('post_id')],
+                order_by=[F('created_at').desc(), F('id').desc()],
+            )
+        ).filter(row__lte=preview_size).select_related('user__profile')
+        for comment in latest:
+            previews[comment.post_id].append(comment)
+
+    for post in posts:
+        post.liked_by_me = post.id in liked_ids
+        post.comment_preview = sorted(previews[post.id], key=lambda c: (c.created_at, c.id))
+    return posts
@@ -0,0 +1,59 @@
+"""
+Cached social graph: each user's friend ids as a sorted array('q') in the
+Django cache, so friendship checks on hot pages need no queries on a hit.
+Friendship.befriend/unfriend drop the entries for both users; the timeout only
+bounds staleness from edges removed by cascade (e.g. an account deletion).
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import get_or_set_many
+
+CACHE_TIMEOUT = getattr(settings, 'SOCIAL_GRAPH_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def _cache_key(user_id):
+    return f'graph:friends:{user_id}'
+
+
+def _load(user_id):
+    from .models import Friendship
+
+    return array('q', sorted(Friendship.friend_ids(user_id)))
+
+
+def friends_of(user_id):
+    """Sorted array of user_id's friend ids."""
+    key = _cache_key(user_id)
+    friends = cache.get(key)
+    if friends is None:
+        friends = _load(user_id)
+        cache.set(key, friends, CACHE_TIMEOUT)
+    return friends
+
+
+def friends_of_many(user_ids):
+    """{user_id: sorted array of friend ids}, loading only the cache misses."""
+    return get_or_set_many(
+        {_cache_key(uid): uid for uid in user_ids},
+        lambda missing: {uid: _load(uid) for uid in missing},
+        CACHE_TIMEOUT,
+    )
+
+
+def are_friends(user_a_id, user_b_id):
+    friends = friends_of(user_a_id)
+    i = bisect_left(friends, user_b_id)
+    return i < len(friends) and friends[i] == user_b_id
+
+
+def mutual_count(user_a_id, user_b_id):
+    graphs = friends_of_many([user_a_id, user_b_id])
+    return len(set(graphs[user_a_id]).intersection(graphs[user_b_id]))
+
+
+def invalidate(*user_ids):
+    cache.delete_many([_cache_key(uid) for uid in user_ids])
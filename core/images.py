@@ -0,0 +1,177 @@
+"""
+Resized, recompressed derivatives of uploaded images.
+
+Each upload gets a set of variants (see the *_SPECS below), written next to
+the original under a derived/ folder as both JPEG and WebP, with EXIF
+dropped (orientation is applied first). The generated paths are stored in a
+JSONField on the owning row ({'source': name, label: {'jpeg': path, 'webp':
+path}}), so templates pick a variant without touching storage (see
+Profile.profile_picture_url, Post.image_url and the media_tags library).
+Generation runs as a background task whenever the source file changes.
+
+The uploaded original is kept (the lightbox shows it), but it is re-encoded
+without metadata before it is stored, so GPS and camera EXIF never reach
+storage (see strip_upload).
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from . import blobs
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+# label -> (width, height); height None keeps the aspect ratio (never upscaled)
+AVATAR_SPECS = {'64': (64, 64), '128': (128, 128)}
+FEED_SPECS = {'720': (720, None), '1080': (1080, None)}
+COVER_SPECS = {'cover': (1500, 500)}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+# Originals in these formats are rewritten on upload; others are stored as is
+STRIP_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+ORIENTATION_TAG = 0x0112
+
+
+def _resize(image, width, height):
+    if height is None:
+        if image.width <= width:
+            return image.copy()
+        return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    # Fixed box: scale to cover it, then centre-crop
+    return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+
+def _encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'jpeg':
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def strip_metadata(file):
+    """
+    The image in `file` re-encoded without EXIF/XMP/comments, as bytes, or
+    None to store it unchanged (not an image, animated, or another format).
+    JPEGs keep their quantization tables, so there's no generation loss, and
+    their orientation tag, so they still display upright.
+    """
+    try:
+        file.seek(0)
+        image = Image.open(file)
+        image.load()
+    except (OSError, ValueError):
+        return None
+    finally:
+        file.seek(0)
+    if image.format not in STRIP_FORMATS or getattr(image, 'is_animated', False):
+        return None
+
+    buffer = BytesIO()
+    icc_profile = image.info.get('icc_profile')
+    if image.format == 'JPEG':
+        exif = Image.Exif()
+        orientation = image.getexif().get(ORIENTATION_TAG)
+        if orientation:
+            exif[ORIENTATION_TAG] = orientation
+        image.save(buffer, 'JPEG', quality='keep', exif=exif, icc_profile=icc_profile, comment=b'', xmp=b'')
+    else:
+        fmt = image.format
+        # No EXIF is kept, so bake the orientation into the pixels
+        image = ImageOps.exif_transpose(image)
+        if fmt == 'PNG':
+            image.save(buffer, 'PNG', icc_profile=icc_profile)
+        else:
+            image.save(buffer, 'WEBP', quality=90, exif=b'', xmp=b'', icc_profile=icc_profile)
+    return buffer.getvalue()
+
+
+def strip_upload(field_file):
+    """Swap a new, not yet stored upload on an ImageField for its stripped copy."""
+    if not field_file or field_file._committed:
+        return
+    data = strip_metadata(field_file.file)
+    if data is not None:
+        field_file.file = ContentFile(data, name=field_file.name)
+
+
+def variant_path(source, label, ext):
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/derived/{stem}_{label}.{ext}'
+
+
+def render_variants(source, specs, storage=default_storage):
+    """Write every variant of `source` and return the dict to store on the row."""
+    try:
+        with storage.open(source, 'rb') as f:
+            image = Image.open(f)
+            # Bake in the EXIF orientation, then drop all metadata by re-encoding pixels only
+            image = ImageOps.exif_transpose(image).convert('RGB')
+    except OSError as e:
+        # Missing or not an image: retrying won't help, so record the source
+        # with no variants and let templates fall back to the original
+        logger.warning('Could not read %s for resizing: %s', source, e)
+        return {'source': source}
+
+    variants = {'source': source}
+    for label, (width, height) in specs.items():
+        resized = _resize(image, width, height)
+        variants[label] = {}
+        for fmt, ext in (('jpeg', 'jpg'), ('webp', 'webp')):
+            # Storage adds a content hash to the name, so nothing is overwritten
+            variants[label][fmt] = storage.save(variant_path(source, label, ext), ContentFile(_encode(resized, fmt)))
+    return variants
+
+
+def is_stale(field, variants, default=None):
+    """True if the uploaded file has no variants yet (defaults are static, skip them)."""
+    return bool(field) and field.name != default and variants.get('source') != field.name
+
+
+@task
+def generate_post_variants(post_id):
+    from .models import Post
+
+    post = Post.objects.filter(id=post_id).only('image', 'image_variants').first()
+    if post is None or not is_stale(post.image, post.image_variants):
+        return
+    variants = render_variants(post.image.name, FEED_SPECS)
+    # Only store them if the image wasn't replaced meanwhile
+    # (and bump the version so cached post cards pick up the new URLs)
+    if Post.objects.filter(id=post_id, image=post.image.name).update(
+        image_variants=variants, version=F('version') + 1,
+    ):
+        _swap_references(post.image_variants, variants)
+
+
+@task
+def generate_profile_variants(profile_id):
+    from .models import Profile
+
+    profile = Profile.objects.filter(id=profile_id).first()
+    if profile is None:
+        return
+    if is_stale(profile.profile_picture, profile.picture_variants, 'default_profile.png'):
+        variants = render_variants(profile.profile_picture.name, AVATAR_SPECS)
+        if Profile.objects.filter(id=profile_id, profile_picture=profile.profile_picture.name).update(picture_variants=variants):
+            _swap_references(profile.picture_variants, variants)
+    if is_stale(profile.cover_photo, profile.cover_variants, 'default_cover.png'):
+        variants = render_variants(profile.cover_photo.name, COVER_SPECS)
+        if Profile.objects.filter(id=profile_id, cover_photo=profile.cover_photo.name).update(cover_variants=variants):
+            _swap_references(profile.cover_variants, variants)
+
+
+def _swap_references(old, new):
+    # .update() skips the refcount signals
+    blobs.retain(blobs.variant_names(new))
+    blobs.release(blobs.variant_names(old))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core import blobs
+
+
+class Command(BaseCommand):
+    help = 'Delete media blobs no Post, Profile or Message references (deleted posts, replaced avatars/covers).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep unreferenced blobs saved more recently than this')
+        parser.add_argument('--recount', action='store_true',
+                            help='Rebuild refcounts from the tables first')
+        parser.add_argument('--dry-run', action='store_true', help='Report without deleting.')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write(f'{blobs.recount()} blob(s) referenced.')
+        removed, freed = blobs.collect_garbage(timedelta(hours=options['grace_hours']), options['dry_run'])
+        verb = 'would be removed' if options['dry_run'] else 'removed'
+        self.stdout.write(self.style.SUCCESS(f'{removed} blob(s) {verb} ({freed} bytes).'))
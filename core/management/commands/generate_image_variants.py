@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core import images
+from core.models import Post, Profile
+
+
+class Command(BaseCommand):
+    help = 'Queue resized JPEG/WebP variants for uploads that predate them (or whose source changed).'
+
+    def handle(self, *args, **options):
+        queued = 0
+        posts = Post.objects.exclude(image='').exclude(image=None).only('id', 'image', 'image_variants')
+        for post in posts.iterator():
+            if images.is_stale(post.image, post.image_variants):
+                images.generate_post_variants.delay(post.id)
+                queued += 1
+
+        for profile in Profile.objects.iterator():
+            if (images.is_stale(profile.profile_picture, profile.picture_variants, 'default_profile.png')
+                    or images.is_stale(profile.cover_photo, profile.cover_variants, 'default_cover.png')):
+                images.generate_profile_variants.delay(profile.id)
+                queued += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{queued} image job(s) queued.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were started but not touched within UPLOAD_EXPIRY.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'{uploads.purge_stale()} stale upload(s) removed.'))
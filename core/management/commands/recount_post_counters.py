@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import COUNTER_FIELDS, drifted_posts
+from core.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post like/comment/share counters that have drifted from the source tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        batch = []
+        fixed = 0
+
+        for post in drifted_posts().order_by('id').iterator(chunk_size=batch_size):
+            post.like_count = post.actual_likes
+            post.comment_count = post.actual_comments
+            post.share_count = post.actual_shares
+            batch.append(post)
+            if len(batch) >= batch_size:
+                fixed += self.flush(batch, options['dry_run'])
+                batch = []
+        fixed += self.flush(batch, options['dry_run'])
+
+        verb = 'would be fixed' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{fixed} post(s) with drifted counters {verb}.'))
+
+    def flush(self, batch, dry_run):
+        if batch and not dry_run:
+            Post.objects.bulk_update(batch, COUNTER_FIELDS)
+        return len(batch)
@@ -0,0 +1,50 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (post fan-out, image derivatives, ...) on a thread pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Run whatever is due, then exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f'Ran {tasks.run_pending()} job(s)')
+            return
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        threads = options['threads']
+        worker_id = tasks.new_worker_id()
+        in_flight = set()
+        self.stdout.write(f'Worker {worker_id} started with {threads} thread(s)')
+
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job') as pool:
+            while not self.stopping:
+                tasks.release_stale()
+                in_flight = {f for f in in_flight if not f.done()}
+                # Only claim what there's a free thread for; the rest stays
+                # queued where another worker can pick it up
+                free = threads - len(in_flight)
+                jobs = tasks.claim(worker_id, free) if free else []
+                for job in jobs:
+                    in_flight.add(pool.submit(tasks.execute, job))
+                if not jobs:
+                    time.sleep(options['poll_interval'])
+        self.stdout.write('Worker stopped')
+
+    def stop(self, *args):
+        # Finish the jobs already running, claim nothing new
+        self.stopping = True
@@ -0,0 +1,173 @@
+"""
+Serving files from MEDIA_ROOT: caching headers and byte ranges (video seeking).
+
+Uploads are stored as content-addressed blobs (core.storage), so their URLs
+get `Cache-Control: public, max-age=<1 year>, immutable` and browsers and
+CDNs never ask again. Files saved before blobs get MEDIA_CACHE_MAX_AGE and
+revalidate against a strong ETag/Last-Modified, which is answered with 304.
+
+Responses are FileResponses over the open file, so under a WSGI server with
+wsgi.file_wrapper (gunicorn, uWSGI) the bytes go out via sendfile and never
+pass through Python; only the dev server falls back to reading blocks. With
+MEDIA_OFFLOAD set, the view only checks the path and hands the transfer to the
+front proxy:
+
+    'x-accel-redirect'  nginx, internal location at MEDIA_ACCEL_PREFIX
+    'x-sendfile'        Apache mod_xsendfile / lighttpd, absolute path
+
+Ranges follow RFC 9110: one range per request (first-last, first- or -suffix),
+416 for ranges past the end, If-Range against the ETag or Last-Modified, and
+HEAD answered with headers only.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import is_blob
+
+MEDIA_OFFLOAD = getattr(settings, 'MEDIA_OFFLOAD', None)
+MEDIA_ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+MEDIA_CACHE_MAX_AGE = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 60 * 60)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class RangeFile:
+    """An open file limited to `length` bytes from its current position."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # sendfile starts from the fd's position and stops at Content-Length
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Return (first, last) inclusive for a single-range header, or None to send
+    the whole file (no header, multiple ranges or syntax we don't handle).
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - suffix, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise RangeNotSatisfiable
+    if last < first:
+        return None  # Invalid, so ignored
+    return first, last
+
+
+def cache_control(path):
+    if is_blob(path):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={MEDIA_CACHE_MAX_AGE}'
+
+
+def etag_for(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag  # Strong comparison, so weak tags never match
+    return parse_http_date_safe(value) == int(mtime)
+
+
+def serve_file(request, path, content_type=None):
+    # ../ paths raise SuspiciousFileOperation, which Django turns into a 400
+    full_path = safe_join(settings.MEDIA_ROOT, path)
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('File not found')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found')
+
+    content_type = content_type or mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if MEDIA_OFFLOAD in ('x-accel-redirect', 'x-sendfile'):
+        response = HttpResponse(content_type=content_type)
+        if MEDIA_OFFLOAD == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + quote(path)
+        else:
+            response['X-Sendfile'] = full_path
+        # The proxy keeps these on the file it sends
+        response['Cache-Control'] = cache_control(path)
+        return response
+
+    etag, last_modified = etag_for(stat), http_date(stat.st_mtime)
+    # If-None-Match / If-Modified-Since -> 304, If-Match failures -> 412
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        if response.status_code == 304:
+            response['ETag'] = etag
+            response['Cache-Control'] = cache_control(path)
+        return response
+
+    size = stat.st_size
+    range_header = request.headers.get('Range', '')
+    if not if_range_matches(request, etag, stat.st_mtime):
+        range_header = ''  # File changed since the client's first request: send all of it
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    first, last = byte_range or (0, size - 1)
+    length = last - first + 1 if size else 0
+    status = 206 if byte_range else 200
+
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=content_type)
+    else:
+        f = open(full_path, 'rb')
+        f.seek(first)
+        response = FileResponse(RangeFile(f, length), status=status, content_type=content_type)
+        response.block_size = BLOCK_SIZE
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = cache_control(path)
+    if byte_range:
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    return response
@@ -0,0 +1,95 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Conversation, ConversationParticipant, Message
+from .pagination import keyset_page
+
+INBOX_PAGE_SIZE = 20
+CHAT_PAGE_SIZE = 30
+
+
+def _unread_above(cursor):
+    # Messages received by the participant's user above `cursor`, for a correlated subquery
+    counts = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'),
+        receiver_id=OuterRef('user_id'),
+        id__gt=cursor,
+    ).order_by().values('conversation_id').annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(counts), 0)
+
+
+def refresh_unread(conversation_id, user_id):
+    """Recompute a participant's cached unread_count from its read cursor in one UPDATE."""
+    ConversationParticipant.objects.filter(conversation_id=conversation_id, user_id=user_id).update(
+        unread_count=_unread_above(OuterRef('last_read_message_id')),
+    )
+
+
+def mark_read(conversation_id, user_id, up_to_message_id):
+    """
+    Move the read cursor forward to `up_to_message_id` (never backwards) and
+    refresh unread_count, as a single-row UPDATE. Messages with a higher id
+    that arrived meanwhile stay unread.
+    """
+    cursor = Greatest(OuterRef('last_read_message_id'), Value(up_to_message_id))
+    return ConversationParticipant.objects.filter(conversation_id=conversation_id, user_id=user_id).update(
+        last_read_message_id=Greatest(F('last_read_message_id'), Value(up_to_message_id)),
+        unread_count=_unread_above(cursor),
+    )
+
+
+def unread_messages(conversation_id, user_id):
+    """Messages `user_id` received in the conversation that are above their read cursor."""
+    cursor = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id, user_id=user_id,
+    ).values('last_read_message_id')
+    return Message.objects.filter(
+        conversation_id=conversation_id, receiver_id=user_id, id__gt=Subquery(cursor),
+    ).order_by('id')
+
+
+def unread_conversation_count(user_id):
+    # Number of people with unread messages for this user (the nav badge)
+    return ConversationParticipant.objects.filter(user_id=user_id, unread_count__gt=0).count()
+
+
+def message_preview(message):
+    return (message.content or ('Sent a file' if message.file else ''))[:100]
+
+
+def record_message(message):
+    """Update the inbox summary and the receiver's unread count for a new message."""
+    # The id guard keeps a slower, older send from overwriting a newer summary
+    Conversation.objects.filter(id=message.conversation_id).filter(
+        Q(last_message__isnull=True) | Q(last_message_id__lt=message.id)
+    ).update(
+        last_message=message,
+        last_message_at=message.timestamp,
+        last_message_preview=message_preview(message),
+    )
+    ConversationParticipant.objects.filter(conversation_id=message.conversation_id).filter(
+        Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.timestamp)
+    ).update(last_message_at=message.timestamp)
+    refresh_unread(message.conversation_id, message.receiver_id)
+
+
+def inbox_page(user_id, cursor=None, limit=INBOX_PAGE_SIZE):
+    """One page of the user's conversations, most recent first, as participant rows."""
+    entries = ConversationParticipant.objects.filter(
+        user_id=user_id, last_message_at__isnull=False,
+    ).select_related('conversation', 'partner__profile')
+    return keyset_page(entries, 'last_message_at', cursor=cursor, limit=limit)
+
+
+def history_page(conversation_id, before_id=None, limit=CHAT_PAGE_SIZE):
+    """
+    The `limit` messages preceding `before_id` (or the latest ones), oldest
+    first, plus whether older messages remain. Walks the (conversation, id)
+    index backwards, so the cost doesn't grow with the length of the chat.
+    """
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    if before_id is not None:
+        messages = messages.filter(id__lt=before_id)
+    page = list(messages.order_by('-id')[:limit + 1])
+    has_more = len(page) > limit
+    return page[:limit][::-1], has_more
@@ -1,4 +1,4 @@
-from django.utils import timezone
+from . import presence
 
 class UpdateLastActivityMiddleware:
     def __init__(self, get_response):
@@ -6,12 +6,9 @@ class UpdateLastActivityMiddleware:
 
     def __call__(self, request):
         if request.user.is_authenticated:
-            # We use a slight optimization properly: only update if it's been > 1 minute?
-            # Or just update every request. For this scale, every request is fine.
-            # Ideally we check session, but profile is easier.
-            Profile = request.user.profile
-            Profile.last_activity = timezone.now()
-            Profile.save(update_fields=['last_activity'])
+            # Recorded in the cache; Profile.last_activity is written through
+            # at most once per PRESENCE_WRITE_INTERVAL, in batches
+            presence.touch(request.user.id)
 
         response = self.get_response(request)
         return response
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:33
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Comment = apps.get_model('core', 'Comment')
+
+    def count_of(queryset, key):
+        counts = queryset.filter(**{key: OuterRef('pk')}).order_by().values(key).annotate(n=Count('id')).values('n')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    Post.objects.update(
+        like_count=count_of(Post.likes.through.objects.all(), 'post_id'),
+        comment_count=count_of(Comment.objects.all(), 'post_id'),
+        share_count=count_of(Post.objects.all(), 'shared_post_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_post_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='share_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model('core', 'Message')
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationParticipant = apps.get_model('core', 'ConversationParticipant')
+
+    pairs = set()
+    for sender_id, receiver_id in Message.objects.values_list('sender_id', 'receiver_id').distinct():
+        pairs.add(tuple(sorted((sender_id, receiver_id))))
+
+    for low, high in pairs:
+        conversation = Conversation.objects.create(user_low_id=low, user_high_id=high)
+        messages = Message.objects.filter(sender_id__in=(low, high), receiver_id__in=(low, high))
+        messages.update(conversation=conversation)
+
+        for user_id in {low, high}:
+            received = messages.filter(receiver_id=user_id)
+            unread = received.filter(is_read=False)
+            first_unread = unread.order_by('id').values_list('id', flat=True).first()
+            if first_unread is not None:
+                last_read = first_unread - 1
+            else:
+                last_read = received.order_by('-id').values_list('id', flat=True).first() or 0
+            ConversationParticipant.objects.create(
+                conversation=conversation,
+                user_id=user_id,
+                last_read_message_id=last_read,
+                unread_count=received.filter(id__gt=last_read).count(),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0003_post_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.PositiveBigIntegerField(default=0)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='core.conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user_high',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user_low',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='core.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', 'unread_count'], name='participant_unread_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationparticipant',
+            constraint=models.UniqueConstraint(fields=('conversation', 'user'), name='unique_conversation_participant'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='unique_conversation_pair'),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
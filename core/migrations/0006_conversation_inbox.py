@@ -0,0 +1,69 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_inbox(apps, schema_editor):
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationParticipant = apps.get_model('core', 'ConversationParticipant')
+    Message = apps.get_model('core', 'Message')
+
+    for conversation in Conversation.objects.all():
+        ConversationParticipant.objects.filter(conversation=conversation, user_id=conversation.user_low_id).update(partner_id=conversation.user_high_id)
+        ConversationParticipant.objects.filter(conversation=conversation, user_id=conversation.user_high_id).update(partner_id=conversation.user_low_id)
+
+        last = Message.objects.filter(conversation=conversation).order_by('-id').first()
+        if last:
+            conversation.last_message = last
+            conversation.last_message_at = last.timestamp
+            conversation.last_message_preview = (last.content or ('Sent a file' if last.file else ''))[:100]
+            conversation.save(update_fields=['last_message', 'last_message_at', 'last_message_preview'])
+            ConversationParticipant.objects.filter(conversation=conversation).update(last_message_at=last.timestamp)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0005_message_conversation_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='partner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='participant_inbox_idx'),
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversationparticipant',
+            name='partner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
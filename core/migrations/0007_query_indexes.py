@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_conversation_inbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['from_user', 'to_user'], name='friendrequest_pair_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['to_user', '-created_at'], name='friendrequest_incoming_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['visibility', '-created_at', '-id'], name='post_visibility_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('image', ''), _negated=True), fields=['user', '-created_at', '-id'], name='post_user_photos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('video', ''), _negated=True), fields=['user', '-created_at', '-id'], name='post_user_videos_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; other databases fall back to core.search.LikeBackend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE core_post_fts USING fts5(content, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE core_user_fts USING fts5(username, bio, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute('INSERT INTO core_post_fts (rowid, content) SELECT id, content FROM core_post')
+    schema_editor.execute(
+        "INSERT INTO core_user_fts (rowid, username, bio) "
+        "SELECT u.id, u.username, COALESCE(p.bio, '') FROM auth_user u "
+        "LEFT JOIN core_profile p ON p.user_id = u.id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS core_post_fts')
+    schema_editor.execute('DROP TABLE IF EXISTS core_user_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_friends(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    Friendship = apps.get_model('core', 'Friendship')
+    # The M2M held each friendship twice (once per side); keep one row per pair
+    pairs = set()
+    for user_id, friend_id in Profile.friends.through.objects.values_list('profile__user_id', 'user_id'):
+        if user_id != friend_id:
+            pairs.add(tuple(sorted((user_id, friend_id))))
+    Friendship.objects.bulk_create(
+        [Friendship(user_low_id=low, user_high_id=high) for low, high in pairs],
+        batch_size=500,
+    )
+
+
+def restore_friends(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    Friendship = apps.get_model('core', 'Friendship')
+    profile_ids = dict(Profile.objects.values_list('user_id', 'id'))
+    Through = Profile.friends.through
+    rows = []
+    for low, high in Friendship.objects.values_list('user_low_id', 'user_high_id'):
+        rows.append(Through(profile_id=profile_ids[low], user_id=high))
+        rows.append(Through(profile_id=profile_ids[high], user_id=low))
+    Through.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_high', 'user_low'], name='friendship_high_low_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='unique_friendship_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('user_low__lt', models.F('user_high'))), name='friendship_low_lt_high'),
+        ),
+        migrations.RunPython(copy_friends, restore_friends),
+        migrations.RemoveField(
+            model_name='profile',
+            name='friends',
+        ),
+    ]
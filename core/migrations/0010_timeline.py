@@ -0,0 +1,56 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BACKFILL_LENGTH = 800
+
+
+def backfill_timelines(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('core', 'Post')
+    Friendship = apps.get_model('core', 'Friendship')
+    TimelineEntry = apps.get_model('core', 'TimelineEntry')
+
+    friends = {}
+    for low, high in Friendship.objects.values_list('user_low_id', 'user_high_id'):
+        friends.setdefault(low, set()).add(high)
+        friends.setdefault(high, set()).add(low)
+
+    for user_id in User.objects.values_list('id', flat=True):
+        posts = Post.objects.filter(
+            models.Q(user_id=user_id) | models.Q(user_id__in=friends.get(user_id, ()), visibility='public')
+        ).order_by('-created_at', '-id').values_list('id', 'created_at')[:BACKFILL_LENGTH]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0009_friendship'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,27 @@
-from django.db import models
+import os
+import uuid
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.utils import timezone
-from datetime import timedelta
 
+from django.core.files.storage import default_storage
 from django.templatetags.static import static
+from django.utils import timezone
+
+from . import graph, presence, profile_summary
+
+
+def _variant_url(field, variants, label, fmt):
+    # Variants of a replaced file are ignored until they're regenerated
+    if not variants or variants.get('source') != field.name:
+        return None
+    path = variants.get(label, {}).get(fmt)
+    return default_storage.url(path) if path else None
+
+
+def _avatar_state(profile):
+    return profile.profile_picture.name, profile.picture_variants.get('source', '')
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -11,8 +29,10 @@ class Profile(models.Model):
     profile_picture = models.ImageField(upload_to='profile_pics/', default='default_profile.png', blank=True)
     cover_photo = models.ImageField(upload_to='cover_photos/', default='default_cover.png', blank=True)
     location = models.CharField(max_length=100, blank=True)
-    friends = models.ManyToManyField(User, blank=True, related_name='friends')
     last_activity = models.DateTimeField(null=True, blank=True)
+    # Resized JPEG/WebP copies, filled in by core.images
+    picture_variants = models.JSONField(default=dict, blank=True)
+    cover_variants = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f'{self.user.username} Profile'
@@ -33,33 +53,190 @@ class Profile(models.Model):
             return self.cover_photo.url
         return static('img/default_cover.png')
 
+    def profile_picture_url(self, size, fmt='jpeg'):
+        # Falls back to the original until the variants have been generated
+        return _variant_url(self.profile_picture, self.picture_variants, str(size), fmt) or self.get_profile_picture_url
+
+    def cover_photo_url(self, fmt='jpeg'):
+        return _variant_url(self.cover_photo, self.cover_variants, 'cover', fmt) or self.get_cover_photo_url
+
+    @property
+    def friends(self):
+        # Users this profile's owner is friends with (a queryset, so .count/.all work in templates)
+        return User.objects.filter(id__in=list(graph.friends_of(self.user_id)))
+
+    @property
+    def friend_count(self):
+        return len(graph.friends_of(self.user_id))
+
     @property
     def is_online(self):
-        if self.last_activity:
-            return timezone.now() < self.last_activity + timedelta(minutes=5)
-        return False
+        # Presence cache is fresher than the throttled last_activity column
+        return presence.is_online(presence.last_seen(self.user_id) or self.last_activity)
 
 class FriendRequest(models.Model):
     from_user = models.ForeignKey(User, related_name='sent_requests', on_delete=models.CASCADE)
     to_user = models.ForeignKey(User, related_name='received_requests', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # "Already sent?" checks on the profile page and send_friend_request
+            models.Index(fields=['from_user', 'to_user'], name='friendrequest_pair_idx'),
+            # Incoming requests list and the nav badge count
+            models.Index(fields=['to_user', '-created_at'], name='friendrequest_incoming_idx'),
+        ]
+
     def __str__(self):
         return f'{self.from_user.username} -> {self.to_user.username}'
 
+class Friendship(models.Model):
+    # One row per pair of friends, stored with user_low.id < user_high.id
+    user_low = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user_low_id} <-> {self.user_high_id}'
+
+    @staticmethod
+    def _pair(user_a_id, user_b_id):
+        low, high = sorted((user_a_id, user_b_id))
+        return {'user_low_id': low, 'user_high_id': high}
+
+    @classmethod
+    def are_friends(cls, user_a_id, user_b_id):
+        # Single lookup on the unique (user_low, user_high) index; views use
+        # the cached core.graph.are_friends instead
+        return cls.objects.filter(**cls._pair(user_a_id, user_b_id)).exists()
+
+    @classmethod
+    def befriend(cls, user_a_id, user_b_id):
+        cls.objects.bulk_create([cls(**cls._pair(user_a_id, user_b_id))], ignore_conflicts=True)
+        # bulk_create skips the post_save receivers, so refresh friend counts here too
+        cls._invalidate_on_commit(user_a_id, user_b_id)
+
+    @classmethod
+    def unfriend(cls, user_a_id, user_b_id):
+        """Returns True if the two users were friends."""
+        deleted, _ = cls.objects.filter(**cls._pair(user_a_id, user_b_id)).delete()
+        cls._invalidate_on_commit(user_a_id, user_b_id)
+        return bool(deleted)
+
+    @staticmethod
+    def _invalidate_on_commit(user_a_id, user_b_id):
+        # Not before: a request in between would re-cache the old friend sets
+        # from the uncommitted table and keep them for the full cache timeout
+        def invalidate():
+            graph.invalidate(user_a_id, user_b_id)
+            profile_summary.invalidate(user_a_id, user_b_id)
+        transaction.on_commit(invalidate)
+
+    @classmethod
+    def friend_ids(cls, user_id):
+        """Queryset of the ids of user_id's friends (usable as a subquery)."""
+        return cls.objects.filter(
+            models.Q(user_low_id=user_id) | models.Q(user_high_id=user_id)
+        ).annotate(
+            friend_id=models.Case(
+                models.When(user_low_id=user_id, then=models.F('user_high_id')),
+                default=models.F('user_low_id'),
+            )
+        ).values_list('friend_id', flat=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_friendship_pair'),
+            models.CheckConstraint(check=models.Q(user_low__lt=models.F('user_high')), name='friendship_low_lt_high'),
+        ]
+        indexes = [
+            # Friend lists look a user up on either side of the pair
+            models.Index(fields=['user_high', 'user_low'], name='friendship_high_low_idx'),
+        ]
+
+class Conversation(models.Model):
+    # One row per pair of users, stored with user_low.id < user_high.id
+    user_low = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Inbox summary, updated whenever a message is sent
+    last_message = models.ForeignKey('Message', related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f'{self.user_low_id} <-> {self.user_high_id}'
+
+    @classmethod
+    def between(cls, user_a_id, user_b_id, create=True):
+        low, high = sorted((user_a_id, user_b_id))
+        if not create:
+            return cls.objects.filter(user_low_id=low, user_high_id=high).first()
+        conversation, created = cls.objects.get_or_create(user_low_id=low, user_high_id=high)
+        if created:
+            ConversationParticipant.objects.bulk_create([
+                ConversationParticipant(conversation=conversation, user_id=low, partner_id=high),
+                ConversationParticipant(conversation=conversation, user_id=high, partner_id=low),
+            ], ignore_conflicts=True)
+        return conversation
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_conversation_pair'),
+        ]
+
+class ConversationParticipant(models.Model):
+    # Per-user read cursor: everything in the conversation with id <= last_read_message_id is read
+    conversation = models.ForeignKey(Conversation, related_name='participants', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='conversation_memberships', on_delete=models.CASCADE)
+    partner = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Copy of conversation.last_message_at so each user's inbox is one index range scan
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.user_id} in {self.conversation_id} ({self.unread_count} unread)'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='unique_conversation_participant'),
+        ]
+        indexes = [
+            # Unread badge: count of this user's conversations with unread_count > 0
+            models.Index(fields=['user', 'unread_count'], name='participant_unread_idx'),
+            # Inbox: this user's conversations, most recent first
+            models.Index(fields=['user', '-last_message_at', '-id'], name='participant_inbox_idx'),
+        ]
+
 class Message(models.Model):
+    conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
     content = models.TextField(blank=True)
     file = models.FileField(upload_to='chat_files/', blank=True, null=True)
+    # Name the file was uploaded with; storage names are content hashes
+    file_name = models.CharField(max_length=255, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     def __str__(self):
         return f'{self.sender.username} -> {self.receiver.username}: {self.content[:20]}'
 
+    @property
+    def attachment_name(self):
+        return self.file_name or os.path.basename(self.file.name)
+
+    def save(self, *args, **kwargs):
+        if not self.conversation_id:
+            self.conversation = Conversation.between(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Unread/new-message lookups: messages in a conversation above a read cursor
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+        ]
 
 class Post(models.Model):
     VISIBILITY_CHOICES = (
@@ -71,19 +248,56 @@ class Post(models.Model):
     content = models.TextField(blank=True)
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
     video = models.FileField(upload_to='post_videos/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
+    # Bumped whenever the rendered card changes (edits, new image variants);
+    # part of the post-card fragment cache key
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='public')
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     shared_post = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='shares')
+    # Denormalized counters, kept in step with F() updates (see recount_post_counters)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    share_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'{self.user.username} - {self.created_at}'
     
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
+
+    @property
+    def card_version(self):
+        """Cache key part for the post-card fragments: this post, the shared post and their authors' avatars."""
+        parts = [self.id, self.version, self.user.username, *_avatar_state(self.user.profile)]
+        shared = self.shared_post if self.shared_post_id else None
+        if shared:
+            parts += [shared.id, shared.version, shared.user.username, *_avatar_state(shared.user.profile)]
+        return ':'.join(map(str, parts))
+
+    def image_url(self, width, fmt='jpeg'):
+        return _variant_url(self.image, self.image_variants, str(width), fmt) or (self.image.url if self.image else None)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Serves the keyset-paginated feed: one range scan per page
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            models.Index(fields=['visibility', '-created_at', '-id'], name='post_visibility_created_idx'),
+            # Profile timeline, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_idx'),
+            # Profile photos/videos tabs only ever look at posts with media,
+            # so keep those indexes small
+            models.Index(
+                fields=['user', '-created_at', '-id'], name='post_user_photos_idx',
+                condition=~models.Q(image=''),
+            ),
+            models.Index(
+                fields=['user', '-created_at', '-id'], name='post_user_videos_idx',
+                condition=~models.Q(video=''),
+            ),
+        ]
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
@@ -94,6 +308,98 @@ class Comment(models.Model):
     def __str__(self):
         return f'{self.user.username} - {self.content[:20]}'
 
+class TimelineEntry(models.Model):
+    # Materialized home timeline: one row per post delivered to a user (see core.timeline)
+    user = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='+', on_delete=models.CASCADE)
+    # Copy of post.created_at so a page is one index range scan
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user_id} <- {self.post_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'),
+        ]
+
+class Job(models.Model):
+    # Queued background task (see core.tasks); rows are deleted once they succeed
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)} [{self.status}]'
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest due jobs; also finds stale running ones
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
 # Signals moved to signals.py
 
 # Trigger a reload to be safe
+
+class ChunkedUpload(models.Model):
+    # A large file arriving in pieces (see core.uploads); deleted once it's
+    # attached to its Post or Message
+    POST_VIDEO = 'post_video'
+    MESSAGE_FILE = 'message_file'
+    PURPOSE_CHOICES = [(POST_VIDEO, 'Post video'), (MESSAGE_FILE, 'Message file')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='chunked_uploads', on_delete=models.CASCADE)
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    # Bytes received so far; the next chunk must start here
+    offset = models.PositiveBigIntegerField(default=0)
+    # SHA-256 of the whole file, if the client sent one, checked on completion
+    checksum = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    class Meta:
+        indexes = [
+            # Purging abandoned uploads
+            models.Index(fields=['updated_at'], name='chunkedupload_updated_idx'),
+        ]
+
+class MediaBlob(models.Model):
+    # One stored file (see core.storage); refcount is how many Post, Profile
+    # and Message fields point at it, kept by core.blobs
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    # Last time a save produced this blob; gc_media leaves recent ones alone
+    stored_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} refs)'
+
+    class Meta:
+        indexes = [
+            # Garbage collection: unreferenced blobs past the grace period
+            models.Index(fields=['refcount', 'stored_at'], name='mediablob_gc_idx'),
+        ]
+
@@ -0,0 +1,47 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+MAX_PAGE_SIZE = 50
+
+
+def encode_cursor(timestamp, pk):
+    """Opaque cursor for the row at (timestamp, pk) in a newest-first listing."""
+    raw = f'{timestamp.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (timestamp, pk) or None if the cursor is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, pk = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def keyset_page(queryset, field, cursor=None, limit=20):
+    """
+    Keyset pagination over (field, id), newest first; pair it with an index on
+    (-field, -id) so each page is a single range scan.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    queryset = queryset.order_by(f'-{field}', '-id')
+
+    position = decode_cursor(cursor)
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk}))
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].id)
+    return rows, next_cursor
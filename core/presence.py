@@ -0,0 +1,143 @@
+"""
+Presence tracking: activity is recorded in the cache (at most once per
+PRESENCE_SEEN_INTERVAL, since the shared cache may be a database table) and only
+written through to Profile.last_activity once per PRESENCE_WRITE_INTERVAL,
+buffered and flushed as a single UPDATE for a batch of users.
+
+A buffered batch is flushed by the next request once it is due, by a timer
+thread FLUSH_INTERVAL seconds after it started (so an idle worker still
+writes it) and at process exit.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+ONLINE_WINDOW = timedelta(minutes=5)
+
+SEEN_INTERVAL = getattr(settings, 'PRESENCE_SEEN_INTERVAL', 30)
+WRITE_INTERVAL = getattr(settings, 'PRESENCE_WRITE_INTERVAL', 60)
+FLUSH_INTERVAL = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 10)
+FLUSH_BATCH_SIZE = getattr(settings, 'PRESENCE_FLUSH_BATCH_SIZE', 100)
+# Off under tests, where a timer or atexit flush would outlive the test database
+BACKGROUND_FLUSH = getattr(settings, 'PRESENCE_BACKGROUND_FLUSH', True)
+
+logger = logging.getLogger(__name__)
+
+_pending = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_timer = None
+
+
+def _seen_key(user_id):
+    return f'presence:seen:{user_id}'
+
+
+def _written_key(user_id):
+    return f'presence:written:{user_id}'
+
+
+def touch(user_id, now=None):
+    """Record activity for a user; cheap enough to call on every request."""
+    now = now or timezone.now()
+    ts = now.timestamp()
+    seen = cache.get(_seen_key(user_id))
+    if seen is None or ts - seen >= SEEN_INTERVAL:
+        cache.set(_seen_key(user_id), ts, timeout=int(ONLINE_WINDOW.total_seconds()) * 2)
+
+    written = cache.get(_written_key(user_id))
+    if written is None or ts - written >= WRITE_INTERVAL:
+        # Claim the write slot up front so concurrent requests don't queue duplicates
+        cache.set(_written_key(user_id), ts, timeout=WRITE_INTERVAL * 2)
+        with _lock:
+            _pending[user_id] = now
+            _schedule_flush()
+    flush_if_due()
+
+
+def last_seen(user_id):
+    """Last activity from the cache, or None if the user hasn't been seen recently."""
+    ts = cache.get(_seen_key(user_id))
+    return datetime.fromtimestamp(ts, dt_timezone.utc) if ts is not None else None
+
+
+def last_seen_many(user_ids):
+    """{user_id: datetime} for the users with a cached activity timestamp."""
+    keys = {_seen_key(uid): uid for uid in user_ids}
+    found = cache.get_many(keys.keys())
+    return {keys[key]: datetime.fromtimestamp(ts, dt_timezone.utc) for key, ts in found.items()}
+
+
+def is_online(last_activity):
+    return last_activity is not None and timezone.now() < last_activity + ONLINE_WINDOW
+
+
+def flush_if_due():
+    with _lock:
+        due = len(_pending) >= FLUSH_BATCH_SIZE or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def _schedule_flush():
+    # Called with _lock held
+    global _timer
+    if BACKGROUND_FLUSH and _timer is None:
+        _timer = threading.Timer(FLUSH_INTERVAL, _background_flush)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _background_flush():
+    global _timer
+    with _lock:
+        _timer = None
+    try:
+        flush()
+    except Exception:
+        logger.exception('Flushing presence timestamps failed')
+    finally:
+        # This thread's own connections
+        connections.close_all()
+
+
+def flush():
+    """Write all buffered activity timestamps to Profile in one UPDATE."""
+    global _last_flush
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not batch:
+        return 0
+
+    from .models import Profile
+
+    try:
+        Profile.objects.filter(user_id__in=batch.keys()).update(
+            last_activity=Case(
+                *[When(user_id=uid, then=Value(ts)) for uid, ts in batch.items()],
+                output_field=DateTimeField(),
+            )
+        )
+    except Exception:
+        # Put the batch back (newer timestamps win) for the next flush
+        with _lock:
+            for uid, ts in batch.items():
+                _pending.setdefault(uid, ts)
+            _schedule_flush()
+        raise
+    return len(batch)
+
+
+if BACKGROUND_FLUSH:
+    atexit.register(_background_flush)
+
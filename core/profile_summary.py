@@ -0,0 +1,50 @@
+"""
+Cached profile aggregates: post, photo, video and friend counts plus the ids
+of the latest photo and video posts, for the profile header and sidebar.
+
+Owners also see their private posts, so each user has two summaries (the
+'all' and 'public' audiences) under one caching.Namespace. Post and
+friendship signals (core.signals) invalidate both at once; Friendship.befriend
+does it itself since bulk_create sends no signals.
+"""
+from django.conf import settings
+from django.db.models import Count, Q
+
+from . import graph
+from .caching import Namespace, get_or_compute
+
+CACHE_TIMEOUT = getattr(settings, 'PROFILE_SUMMARY_CACHE_TIMEOUT', 24 * 60 * 60)
+PREVIEW_SIZE = 9
+
+
+def _namespace(user_id):
+    return Namespace(f'profile:{user_id}')
+
+
+def _compute(user_id, include_private):
+    from .models import Post
+
+    posts = Post.objects.filter(user_id=user_id)
+    if not include_private:
+        posts = posts.filter(visibility='public')
+    summary = posts.aggregate(
+        posts=Count('id'),
+        photos=Count('id', filter=~Q(image='')),
+        videos=Count('id', filter=~Q(video='')),
+    )
+    newest = posts.order_by('-created_at', '-id')
+    summary['friends'] = len(graph.friends_of(user_id))
+    summary['latest_photos'] = list(newest.exclude(image='').values_list('id', flat=True)[:PREVIEW_SIZE])
+    summary['latest_videos'] = list(newest.exclude(video='').values_list('id', flat=True)[:PREVIEW_SIZE])
+    return summary
+
+
+def summary(user_id, include_private=False):
+    """{'posts', 'photos', 'videos', 'friends': counts, 'latest_photos', 'latest_videos': post ids}"""
+    key = _namespace(user_id).key('all' if include_private else 'public')
+    return get_or_compute(key, lambda: _compute(user_id, include_private), CACHE_TIMEOUT)
+
+
+def invalidate(*user_ids):
+    for user_id in user_ids:
+        _namespace(user_id).invalidate()
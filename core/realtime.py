@@ -0,0 +1,114 @@
+"""
+Server push for chat messages and nav badges.
+
+Views publish small events per user; the Server-Sent Events endpoint in
+core.views.event_stream relays them to every open tab of that user. The
+broker is chosen by settings.REALTIME_BROKER so the in-process one can be
+swapped for a shared (e.g. Redis pub/sub) implementation when running more
+than one ASGI worker; such a broker should return True from has_subscribers.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .messaging import unread_conversation_count
+from .models import FriendRequest
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+class InProcessBroker:
+    """
+    Fans events out to subscribers living in this process. Subscriber queues
+    belong to the ASGI event loop, while publish() is usually called from a
+    sync view running in a worker thread, so delivery goes through
+    call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[user_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def has_subscribers(self, user_id):
+        return bool(self._subscribers.get(user_id))
+
+    def publish(self, user_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, (event, data))
+            except RuntimeError:
+                # Event loop already closed; the stream's cleanup will unsubscribe it
+                pass
+
+    @staticmethod
+    def _offer(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A stalled tab shouldn't grow memory; it resyncs counts on reconnect
+            pass
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, 'REALTIME_BROKER', 'core.realtime.InProcessBroker')
+            _broker = import_string(path)()
+    return _broker
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def unread_count(user_id):
+    # Count unique users who sent unread messages
+    return unread_conversation_count(user_id)
+
+
+def friend_request_count(user_id):
+    return FriendRequest.objects.filter(to_user_id=user_id).count()
+
+
+def push_unread_count(user_id):
+    broker = get_broker()
+    # Skip the count query when nobody is listening
+    if broker.has_subscribers(user_id):
+        broker.publish(user_id, 'unread_count', {'count': unread_count(user_id)})
+
+
+def push_friend_request_count(user_id):
+    broker = get_broker()
+    if broker.has_subscribers(user_id):
+        broker.publish(user_id, 'friend_request_count', {'count': friend_request_count(user_id)})
+
+
+def push_message(message):
+    # Just a nudge: the open chat fetches (and marks read) via get_messages_ajax
+    get_broker().publish(message.receiver_id, 'chat_message', {
+        'id': message.id,
+        'sender': message.sender.username,
+    })
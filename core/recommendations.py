@@ -0,0 +1,84 @@
+"""
+"People you may know": friends of friends, ranked by how many mutual friends
+they share with the viewer. The ranked id list is computed with one aggregate
+query over the friends graph, capped at SUGGESTION_LIMIT and cached per user;
+friendship and friend-request changes drop the cached list for both users.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Case, Count, F, Q, When
+
+from . import graph
+from .models import FriendRequest, Friendship
+
+SUGGESTION_LIMIT = 60
+SUGGESTION_PAGE_SIZE = 12
+CACHE_TIMEOUT = getattr(settings, 'SUGGESTION_CACHE_TIMEOUT', 60 * 60)
+
+
+def _cache_key(user_id):
+    return f'pymk:{user_id}'
+
+
+def _ranked(user_id):
+    """[(candidate_id, mutual_count), ...] best first, at most SUGGESTION_LIMIT."""
+    friend_ids = list(graph.friends_of(user_id))
+
+    # Me, my friends and anyone I have a pending request with
+    excluded = set(friend_ids) | {user_id}
+    excluded.update(FriendRequest.objects.filter(from_user_id=user_id).values_list('to_user_id', flat=True))
+    excluded.update(FriendRequest.objects.filter(to_user_id=user_id).values_list('from_user_id', flat=True))
+
+    ranked = []
+    if friend_ids:
+        # Every friendship touching one of my friends; the other end is the candidate
+        ranked = list(
+            Friendship.objects.filter(Q(user_low_id__in=friend_ids) | Q(user_high_id__in=friend_ids))
+            .annotate(candidate=Case(
+                When(user_low_id__in=friend_ids, then=F('user_high_id')),
+                default=F('user_low_id'),
+            ))
+            .exclude(candidate__in=excluded)
+            .values('candidate')
+            .annotate(mutual=Count('id'))
+            .order_by('-mutual', 'candidate')
+            .values_list('candidate', 'mutual')[:SUGGESTION_LIMIT]
+        )
+
+    # Not enough friends-of-friends (e.g. a new account): pad with the newest
+    # members so the section isn't empty
+    if len(ranked) < SUGGESTION_LIMIT:
+        excluded.update(uid for uid, _ in ranked)
+        newest = (
+            User.objects.filter(is_active=True).exclude(id__in=excluded)
+            .order_by('-id').values_list('id', flat=True)[:SUGGESTION_LIMIT - len(ranked)]
+        )
+        ranked.extend((uid, 0) for uid in newest)
+    return ranked
+
+
+def suggestions_page(user_id, page=1, per_page=SUGGESTION_PAGE_SIZE):
+    """
+    One page of suggested users (with profiles), each annotated with
+    .mutual_count; returns (users, has_next).
+    """
+    key = _cache_key(user_id)
+    ranked = cache.get(key)
+    if ranked is None:
+        ranked = _ranked(user_id)
+        cache.set(key, ranked, CACHE_TIMEOUT)
+
+    start = (page - 1) * per_page
+    window = ranked[start:start + per_page]
+    users = User.objects.select_related('profile').in_bulk([uid for uid, _ in window])
+    page_users = []
+    for uid, mutual in window:
+        if uid in users:
+            users[uid].mutual_count = mutual
+            page_users.append(users[uid])
+    return page_users, start + per_page < len(ranked)
+
+
+def invalidate(*user_ids):
+    cache.delete_many([_cache_key(uid) for uid in user_ids])
@@ -0,0 +1,154 @@
+"""
+Full-text search over posts and people.
+
+The backend is chosen by settings.SEARCH_BACKEND. The default keeps an FTS5
+index (core_post_fts / core_user_fts, created by migration 0008) in step with
+posts and profiles from core.signals and ranks matches with bm25. LikeBackend
+is the old icontains behaviour, for databases without FTS5.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .feed import with_card_relations
+from .models import Post
+
+SEARCH_PAGE_SIZE = 20
+
+# Post filters for the search tabs; None means any post
+MEDIA_FILTERS = {
+    'posts': None,
+    'photos': 'image',
+    'videos': 'video',
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH string for free text typed by a user: every word must match,
+    each as a prefix, and quoted so FTS operators in the input are just text.
+    """
+    terms = [t.replace('"', '""') for t in query.split()]
+    return ' '.join(f'"{t}"*' for t in terms if re.search(r'\w', t))
+
+
+class SQLiteFTSBackend:
+    post_table = 'core_post_fts'
+    user_table = 'core_user_fts'
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.post_table} WHERE rowid = %s', [post.id])
+            cursor.execute(f'INSERT INTO {self.post_table} (rowid, content) VALUES (%s, %s)', [post.id, post.content])
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.post_table} WHERE rowid = %s', [post_id])
+
+    def index_user(self, user_id, username, bio):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.user_table} WHERE rowid = %s', [user_id])
+            cursor.execute(
+                f'INSERT INTO {self.user_table} (rowid, username, bio) VALUES (%s, %s, %s)',
+                [user_id, username, bio or ''],
+            )
+
+    def remove_user(self, user_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.user_table} WHERE rowid = %s', [user_id])
+
+    def search_posts(self, query, media=None, offset=0, limit=SEARCH_PAGE_SIZE):
+        expression = match_expression(query)
+        if not expression:
+            return []
+        media_clause = f"AND p.{media} != ''" if media else ''
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT p.id FROM {self.post_table}
+                JOIN core_post p ON p.id = {self.post_table}.rowid
+                WHERE {self.post_table} MATCH %s AND p.visibility = 'public' {media_clause}
+                ORDER BY {self.post_table}.rank, p.id DESC
+                LIMIT %s OFFSET %s
+                """,
+                [expression, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_users(self, query, exclude_id=None, offset=0, limit=SEARCH_PAGE_SIZE):
+        expression = match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT rowid FROM {self.user_table}
+                WHERE {self.user_table} MATCH %s AND rowid != %s
+                -- A hit on the username counts for more than one in the bio
+                ORDER BY bm25({self.user_table}, 10.0, 1.0), rowid
+                LIMIT %s OFFSET %s
+                """,
+                [expression, exclude_id or 0, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class LikeBackend:
+    """Unranked substring matching; nothing to maintain."""
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_user(self, user_id, username, bio):
+        pass
+
+    def remove_user(self, user_id):
+        pass
+
+    def search_posts(self, query, media=None, offset=0, limit=SEARCH_PAGE_SIZE):
+        posts = Post.objects.filter(content__icontains=query, visibility='public')
+        if media:
+            posts = posts.exclude(**{media: ''})
+        return list(posts.values_list('id', flat=True)[offset:offset + limit])
+
+    def search_users(self, query, exclude_id=None, offset=0, limit=SEARCH_PAGE_SIZE):
+        users = User.objects.filter(Q(username__icontains=query) | Q(profile__bio__icontains=query))
+        users = users.exclude(id=exclude_id).order_by('username')
+        return list(users.values_list('id', flat=True)[offset:offset + limit])
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = getattr(settings, 'SEARCH_BACKEND', 'core.search.SQLiteFTSBackend')
+            _backend = import_string(path)()
+    return _backend
+
+
+def _in_rank_order(queryset, ids):
+    found = queryset.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def search_posts(query, kind='posts', page=1, limit=SEARCH_PAGE_SIZE):
+    """One page of ranked public posts for a search tab; returns (posts, has_next)."""
+    ids = get_backend().search_posts(query, MEDIA_FILTERS[kind], (page - 1) * limit, limit + 1)
+    return _in_rank_order(with_card_relations(Post.objects.all()), ids[:limit]), len(ids) > limit
+
+
+def search_users(query, exclude_id=None, page=1, limit=SEARCH_PAGE_SIZE):
+    """One page of ranked people matches; returns (users, has_next)."""
+    ids = get_backend().search_users(query, exclude_id, (page - 1) * limit, limit + 1)
+    return _in_rank_order(User.objects.select_related('profile'), ids[:limit]), len(ids) > limit
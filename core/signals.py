@@ -1,7 +1,14 @@
-from django.db.models.signals import post_save
+from collections import Counter
+
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from .counters import bump
+from .messaging import record_message
+from .models import Profile, Post, Comment, Message, Friendship
+from .search import get_backend as search_backend
+from .suggest import usernames
+from . import blobs, images, profile_summary, timeline
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
@@ -11,3 +18,113 @@ def create_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, **kwargs):
+    # save_profile re-saves the profile on every user save, so this also
+    # picks up username changes
+    search_backend().index_user(instance.user_id, instance.user.username, instance.bio)
+
+IMAGE_FIELDS = {Post: ('image',), Profile: ('profile_picture', 'cover_photo')}
+
+@receiver(pre_save, sender=Profile)
+@receiver(pre_save, sender=Post)
+def strip_image_metadata(sender, instance, **kwargs):
+    # Runs before the file fields store their uploads
+    for field in IMAGE_FIELDS[sender]:
+        images.strip_upload(getattr(instance, field))
+
+@receiver(post_save, sender=Profile)
+def generate_profile_images(sender, instance, **kwargs):
+    if (images.is_stale(instance.profile_picture, instance.picture_variants, 'default_profile.png')
+            or images.is_stale(instance.cover_photo, instance.cover_variants, 'default_cover.png')):
+        images.generate_profile_variants.delay(instance.id)
+
+@receiver(post_save, sender=User)
+def update_username_index(sender, instance, **kwargs):
+    usernames.update(instance.id, instance.username, instance.is_active)
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    search_backend().remove_user(instance.id)
+    usernames.remove(instance.id)
+
+@receiver(pre_save, sender=Post)
+def remember_visibility(sender, instance, update_fields=None, **kwargs):
+    if not instance._state.adding and (update_fields is None or 'visibility' in update_fields):
+        instance._was_private = Post.objects.filter(id=instance.id, visibility='private').exists()
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    # New posts, and private posts that were just made public
+    made_public = instance.__dict__.pop('_was_private', False) and instance.visibility == 'public'
+    if created or made_public:
+        timeline.fan_out.delay(instance.id)
+
+@receiver(post_save, sender=Post)
+def generate_post_images(sender, instance, **kwargs):
+    if images.is_stale(instance.image, instance.image_variants):
+        images.generate_post_variants.delay(instance.id)
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'content' in update_fields:
+        search_backend().index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search_backend().remove_post(instance.id)
+
+@receiver(post_save, sender=Post)
+def refresh_profile_summary(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or {'visibility', 'image', 'video'} & set(update_fields):
+        profile_summary.invalidate(instance.user_id)
+
+@receiver(post_delete, sender=Post)
+def drop_from_profile_summary(sender, instance, **kwargs):
+    profile_summary.invalidate(instance.user_id)
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def refresh_friend_counts(sender, instance, **kwargs):
+    profile_summary.invalidate(instance.user_low_id, instance.user_high_id)
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    bump(instance.post_id, 'comment_count', -1)
+
+@receiver(post_delete, sender=Post)
+def decrement_share_count(sender, instance, **kwargs):
+    if instance.shared_post_id:
+        bump(instance.shared_post_id, 'share_count', -1)
+
+@receiver(post_save, sender=Message)
+def update_conversation_summary(sender, instance, created, **kwargs):
+    if created:
+        record_message(instance)
+
+# Media blob refcounts (core.blobs), for every model with file fields
+
+def _tracks_media(sender, update_fields):
+    return sender in blobs.FILE_FIELDS and (
+        update_fields is None or not set(update_fields).isdisjoint(blobs.tracked_fields(sender))
+    )
+
+@receiver(pre_save)
+def remember_media_references(sender, instance, update_fields=None, **kwargs):
+    if _tracks_media(sender, update_fields):
+        instance._stored_media_refs = blobs.stored_references(instance)
+
+@receiver(post_save)
+def update_media_references(sender, instance, update_fields=None, **kwargs):
+    if _tracks_media(sender, update_fields):
+        old = instance.__dict__.pop('_stored_media_refs', None) or Counter()
+        new = blobs.references(instance)
+        blobs.retain(new - old)
+        blobs.release(old - new)
+
+@receiver(post_delete)
+def release_media_references(sender, instance, **kwargs):
+    if sender in blobs.FILE_FIELDS:
+        blobs.release(blobs.references(instance))
+
@@ -0,0 +1,96 @@
+"""
+Content-addressed media storage.
+
+Every file saved through default storage is hashed (SHA-256) while it is
+streamed to a temp file, then stored once under a sharded path derived from
+the hash: blobs/3f/2a/3f2a...e9.jpg. Saving the same bytes again (a re-upload,
+the same attachment sent twice) returns the existing name without writing
+anything. Each blob has a MediaBlob row whose refcount is kept by core.blobs;
+`manage.py gc_media` deletes blobs nothing references any more.
+
+A name always maps to the same bytes, so core.media serves blob names as
+immutable.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+BLOB_DIR = 'blobs'
+BLOB_NAME_RE = re.compile(r'^%s/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,10})?$' % BLOB_DIR)
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+
+def blob_name(digest, ext=''):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def is_blob(name):
+    return bool(BLOB_NAME_RE.match(name))
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        ext = os.path.splitext(name)[1].lower()
+        if not EXTENSION_RE.match(ext):
+            ext = ''
+
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large uploads, finished chunked uploads): hash it
+            # and move it into place rather than copying
+            source, ours = content.temporary_file_path(), False
+            digest = file_sha256(source)
+        else:
+            source, ours = self.path(f'{BLOB_DIR}/tmp/{uuid.uuid4().hex}'), True
+            digest = self._stream_to(source, content)
+
+        name = blob_name(digest, ext)
+        # Register (or touch) the blob before checking the file, so gc_media's
+        # grace period covers a save that finds an existing copy
+        self._register(name, content.size)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            if ours:
+                os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if ours:
+                os.replace(source, full_path)
+            else:
+                file_move_safe(source, full_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def _stream_to(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        with open(path, 'wb') as f:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                f.write(chunk)
+        return digest.hexdigest()
+
+    def _register(self, name, size):
+        from .models import MediaBlob
+
+        blob, created = MediaBlob.objects.get_or_create(name=name, defaults={'size': size})
+        if not created:
+            MediaBlob.objects.filter(id=blob.id).update(stored_at=timezone.now())
@@ -0,0 +1,87 @@
+"""
+Username typeahead served from memory.
+
+Each process keeps a sorted array of lowercased usernames and answers prefix
+lookups with bisect. The User post_save/post_delete signals patch it in place;
+changes made by other processes are picked up by a full reload in a background
+thread every SUGGEST_REFRESH_INTERVAL seconds, while the old copy keeps serving.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+
+REFRESH_INTERVAL = getattr(settings, 'SUGGEST_REFRESH_INTERVAL', 300)
+SUGGEST_LIMIT = 8
+
+
+class UsernameIndex:
+    def __init__(self):
+        self._keys = []       # sorted (username.lower(), user_id)
+        self._names = {}      # user_id -> username, as displayed
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._refreshing = False
+
+    def reload(self):
+        rows = User.objects.filter(is_active=True).values_list('id', 'username')
+        names = dict(rows)
+        keys = sorted((name.lower(), uid) for uid, name in names.items())
+        with self._lock:
+            self._keys, self._names = keys, names
+            self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            self.reload()
+        finally:
+            self._refreshing = False
+            connection.close()
+
+    def ensure_fresh(self):
+        if self._loaded_at is None:
+            self.reload()
+        elif not self._refreshing and time.monotonic() - self._loaded_at >= REFRESH_INTERVAL:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """Up to `limit` (user_id, username) pairs whose username starts with prefix."""
+        self.ensure_fresh()
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        with self._lock:
+            keys = self._keys
+            start = bisect_left(keys, (prefix,))
+            matches = []
+            for key, uid in keys[start:start + limit]:
+                if not key.startswith(prefix):
+                    break
+                matches.append((uid, self._names[uid]))
+        return matches
+
+    def update(self, user_id, username, active=True):
+        with self._lock:
+            if self._loaded_at is None:
+                return  # Not loaded in this process yet; the first load reads the DB
+            old = self._names.pop(user_id, None)
+            if old is not None:
+                self._remove_key((old.lower(), user_id))
+            if active:
+                self._names[user_id] = username
+                insort(self._keys, (username.lower(), user_id))
+
+    def remove(self, user_id):
+        self.update(user_id, None, active=False)
+
+    def _remove_key(self, key):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+
+usernames = UsernameIndex()
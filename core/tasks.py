@@ -0,0 +1,144 @@
+"""
+Minimal background task runner backed by the Job table.
+
+Decorate a function with @task and call func.delay(*args) to queue it. The job
+row is written in the caller's transaction, so it only becomes visible to
+workers if the request commits. `manage.py run_worker` claims due jobs and
+runs them on a thread pool. Failures are retried with exponential backoff
+up to max_attempts, then left as 'failed' for inspection.
+
+Backpressure: once more than TASK_QUEUE_MAX_DEPTH jobs are waiting, delay()
+runs the task inline instead. Producers slow down and the queue stays bounded.
+With TASKS_EAGER on (tests, or TASKS_EAGER=1 in the environment), every task
+runs inline and no worker is needed.
+Arguments must be JSON serializable; pass ids, not model instances.
+"""
+import logging
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUE_MAX_DEPTH = getattr(settings, 'TASK_QUEUE_MAX_DEPTH', 10000)
+LOCK_TIMEOUT = timedelta(seconds=getattr(settings, 'TASK_LOCK_TIMEOUT', 10 * 60))
+RETRY_BASE_DELAY = 5  # seconds; doubled on every failed attempt
+DEPTH_CACHE_KEY = 'tasks:queue_depth'
+DEPTH_CACHE_TIMEOUT = 5
+
+registry = {}
+
+
+def task(func=None, *, name=None, max_attempts=3):
+    """Register func as a task and give it .delay(*args)."""
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        registry[task_name] = func
+
+        def delay(*args, run_in=0):
+            return enqueue(task_name, *args, run_in=run_in, max_attempts=max_attempts)
+
+        func.delay = delay
+        func.task_name = task_name
+        return func
+
+    return register(func) if func else register
+
+
+def queue_depth():
+    depth = cache.get(DEPTH_CACHE_KEY)
+    if depth is None:
+        depth = Job.objects.filter(status=Job.QUEUED).count()
+        cache.set(DEPTH_CACHE_KEY, depth, DEPTH_CACHE_TIMEOUT)
+    return depth
+
+
+def enqueue(name, *args, run_in=0, max_attempts=3):
+    """Queue registry[name](*args); returns the Job, or None if it ran inline."""
+    if getattr(settings, 'TASKS_EAGER', False) or queue_depth() >= QUEUE_MAX_DEPTH:
+        registry[name](*args)
+        return None
+    return Job.objects.create(
+        name=name,
+        args=list(args),
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=run_in),
+    )
+
+
+def claim(worker_id, limit):
+    """Lock up to `limit` due jobs for this worker and return them."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    ids = list(due.values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    # The status check in the UPDATE makes this safe against a concurrent worker
+    Job.objects.filter(id__in=ids, status=Job.QUEUED).update(
+        status=Job.RUNNING, locked_by=worker_id, locked_at=now,
+    )
+    return list(Job.objects.filter(id__in=ids, status=Job.RUNNING, locked_by=worker_id))
+
+
+def release_stale():
+    """Requeue jobs whose worker died mid-run; returns how many were requeued."""
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - LOCK_TIMEOUT)
+    # The lost run counts as an attempt, so a job that kills its worker
+    # every time ends up failed instead of being requeued forever
+    failed = stale.filter(attempts__gte=F('max_attempts') - 1).update(
+        status=Job.FAILED, attempts=F('attempts') + 1, locked_by='', locked_at=None,
+        last_error='Worker lost while running the job',
+    )
+    if failed:
+        logger.error('%d job(s) failed permanently after losing their worker', failed)
+    return stale.update(status=Job.QUEUED, attempts=F('attempts') + 1, locked_by='', locked_at=None)
+
+
+def execute(job):
+    """Run one claimed job and record the outcome; returns True on success."""
+    try:
+        func = registry[job.name]
+        func(*job.args)
+    except Exception:
+        job.attempts += 1
+        job.last_error = traceback.format_exc()
+        job.locked_by, job.locked_at = '', None
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+            logger.error('Job %s failed permanently:\n%s', job, job.last_error)
+        job.save(update_fields=['attempts', 'last_error', 'locked_by', 'locked_at', 'status', 'run_at'])
+        return False
+    else:
+        job.delete()
+        return True
+    finally:
+        close_old_connections()
+
+
+def run_pending(limit=100):
+    """Run due jobs in this thread until none are left (tests, `run_worker --once`)."""
+    worker_id = new_worker_id()
+    ran = 0
+    while True:
+        jobs = claim(worker_id, limit)
+        if not jobs:
+            return ran
+        for job in jobs:
+            execute(job)
+            ran += 1
+
+
+def new_worker_id():
+    return f'{socket.gethostname()}:{uuid.uuid4().hex[:8]}'
@@ -0,0 +1,31 @@
+from django import template
+
+from ..images import FEED_SPECS
+
+register = template.Library()
+
+
+@register.filter
+def avatar(profile, size=128):
+    """{{ profile|avatar:64 }} -> URL of the 64 or 128px JPEG avatar."""
+    return profile.profile_picture_url(size)
+
+
+@register.filter
+def cover(profile):
+    return profile.cover_photo_url()
+
+
+@register.filter
+def post_image(post, width=720):
+    """{{ post|post_image:720 }} -> URL of the feed-sized JPEG (or the original)."""
+    return post.image_url(width)
+
+
+@register.filter
+def image_srcset(post, fmt='jpeg'):
+    """{{ post|image_srcset:'webp' }} -> "url 720w, url 1080w" for a srcset attribute."""
+    variants = post.image_variants
+    if variants.get('source') != post.image.name or not all(label in variants for label in FEED_SPECS):
+        return ''  # Not generated (or the source couldn't be read)
+    return ', '.join(f'{post.image_url(label, fmt)} {label}w' for label in FEED_SPECS)
@@ -1,3 +1,1256 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from array import array
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .forms import PostForm
+from .feed import COMMENT_PREVIEW_SIZE, hydrate_posts, with_card_relations
+from . import blobs, caching, graph, media, presence, profile_summary, realtime, recommendations, tasks, timeline, uploads, views
+from .messaging import CHAT_PAGE_SIZE, inbox_page, mark_read
+from .search import search_posts, search_users
+from .storage import blob_name
+from .suggest import UsernameIndex, usernames
+from .models import ChunkedUpload, Comment, MediaBlob, ConversationParticipant, FriendRequest, Friendship, Job, Message, Post, Profile, TimelineEntry
+
+
+class FeedPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer, self.author = [User.objects.create_user(n, password='pw') for n in ['viewer', 'author']]
+        posts = [Post.objects.create(user=self.author, content=f'p{i}') for i in range(7)]
+        # All in the same instant, so only the id tells them apart
+        Post.objects.update(created_at=posts[0].created_at)
+        self.expected = [post.id for post in reversed(posts)]
+        self.client.force_login(self.viewer)
+
+    def page(self, **params):
+        data = self.client.get(reverse('feed_page'), params).json()
+        return [int(pk) for pk in re.findall(r'id="like-count-(\d+)"', data['html'])], data['next_cursor']
+
+    def walk(self, limit):
+        seen, cursor = [], None
+        for _ in range(len(self.expected)):
+            ids, cursor = self.page(limit=limit, **({'cursor': cursor} if cursor else {}))
+            seen += ids
+            if cursor is None:
+                break
+        return seen
+
+    def test_cursors_walk_ties_without_gaps_or_duplicates(self):
+        # Public feed (no friends yet), then the timeline
+        self.assertEqual(self.walk(3), self.expected)
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.befriend(self.viewer.id, self.author.id)
+        # What accepting a request queues; entries keep the tied timestamps
+        timeline.backfill_pair(self.viewer.id, self.author.id)
+        self.assertEqual(self.walk(3), self.expected)
+
+    def test_malformed_cursor_or_limit_gives_first_page(self):
+        first = self.page(limit=3)
+        self.assertEqual(self.page(limit=3, cursor='not-a-cursor'), first)
+        self.assertEqual(self.page(limit=3, cursor='bm90fGF8Y3Vyc29y'), first)
+        self.assertEqual(self.page(limit='lots'), (self.expected, None))
+
+
+class FeedHydrationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        self.authors = [User.objects.create_user(f'author{i}', password='pw') for i in range(3)]
+        self.client.force_login(self.viewer)
+
+    def make_posts(self, count):
+        posts = []
+        for i in range(count):
+            author = self.authors[i % len(self.authors)]
+            post = Post.objects.create(user=author, content=f'post {i} searchable')
+            post.likes.add(*self.authors)
+            if i % 2:
+                post.likes.add(self.viewer)
+            for j in range(COMMENT_PREVIEW_SIZE + 2):
+                Comment.objects.create(post=post, user=self.authors[j % len(self.authors)], content=f'c{j}')
+            posts.append(post)
+        # A share, so the shared-post author path is exercised too
+        Post.objects.create(user=self.viewer, shared_post=posts[0], content='shared searchable')
+        call_command('recount_post_counters', stdout=StringIO())
+        return posts
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_hydrate_posts_uses_fixed_number_of_queries(self):
+        self.make_posts(12)
+        posts = list(with_card_relations(Post.objects.all()))
+        with self.assertNumQueries(2):
+            hydrate_posts(posts, self.viewer)
+
+        # Rendering the hydrated attributes must not query either
+        with self.assertNumQueries(0):
+            for post in posts:
+                post.user.profile.get_profile_picture_url
+                if post.shared_post:
+                    post.shared_post.user.profile.get_profile_picture_url
+                for comment in post.comment_preview:
+                    comment.user.profile.get_profile_picture_url
+
+    def test_hydrated_values(self):
+        posts = self.make_posts(2)
+        hydrated = {p.id: p for p in hydrate_posts(Post.objects.filter(id__in=[p.id for p in posts]), self.viewer)}
+
+        first, second = hydrated[posts[0].id], hydrated[posts[1].id]
+        self.assertEqual(first.like_count, 3)
+        self.assertFalse(first.liked_by_me)
+        self.assertEqual(second.like_count, 4)
+        self.assertTrue(second.liked_by_me)
+        self.assertEqual(first.comment_count, COMMENT_PREVIEW_SIZE + 2)
+        self.assertEqual(len(first.comment_preview), COMMENT_PREVIEW_SIZE)
+        # Preview holds the latest comments, oldest first
+        self.assertEqual(first.comment_preview[-1].content, f'c{COMMENT_PREVIEW_SIZE + 1}')
+
+    def test_feed_views_query_count_does_not_grow_with_posts(self):
+        urls = [
+            reverse('home'),
+            reverse('profile', args=[self.authors[0].username]),
+            reverse('search') + '?q=searchable&type=posts',
+        ]
+        self.make_posts(2)
+        for url in urls:
+            self.count_queries(url)  # warm per-user caches
+        baseline = [self.count_queries(url) for url in urls]
+        self.make_posts(10)
+        for url in urls:
+            self.count_queries(url)  # new posts invalidated the profile summary
+        for url, expected in zip(urls, baseline):
+            self.assertEqual(self.count_queries(url), expected, url)
+
+
+class PostCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', password='pw')
+        self.reader = User.objects.create_user('reader', password='pw')
+        self.post = Post.objects.create(user=self.author, content='hello')
+        self.client.force_login(self.reader)
+
+    def test_like_toggle_updates_counter(self):
+        url = reverse('like_post', args=[self.post.id])
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        self.assertEqual(self.client.get(url, **ajax).json(), {'liked': True, 'count': 1})
+        self.assertEqual(self.client.get(url, **ajax).json(), {'liked': False, 'count': 0})
+
+    def test_like_counter_follows_rows(self):
+        # A second toggle from a double-click lands after the first one's row
+        # (and a stale counter) is already there
+        self.post.likes.add(self.reader)
+        Post.objects.filter(id=self.post.id).update(like_count=2)
+        url = reverse('like_post', args=[self.post.id])
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        self.assertEqual(self.client.get(url, **ajax).json(), {'liked': False, 'count': 0})
+        self.assertEqual(self.client.get(url, **ajax).json(), {'liked': True, 'count': 1})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.likes.count()), (1, 1))
+
+    def test_comment_and_share_counters(self):
+        response = self.client.post(reverse('add_comment_ajax'), {'post_id': self.post.id, 'content': 'hi'})
+        self.assertEqual(response.json()['count'], 1)
+        self.client.post(reverse('share_post', args=[self.post.id]))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.share_count), (1, 1))
+
+        self.post.comments.get().delete()
+        self.reader.posts.get().delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.share_count), (0, 0))
+
+    def test_recount_fixes_drift(self):
+        self.post.likes.add(self.reader)
+        Comment.objects.create(post=self.post, user=self.reader, content='x')
+        Post.objects.filter(id=self.post.id).update(comment_count=5)
+
+        call_command('recount_post_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count, self.post.share_count), (1, 1, 0))
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        presence.flush()
+        self.user = User.objects.create_user('active', password='pw')
+        self.client.force_login(self.user)
+
+    def test_requests_within_window_write_once(self):
+        self.client.get(reverse('get_unread_count'))
+        presence.flush()
+        self.user.profile.refresh_from_db()
+        first = self.user.profile.last_activity
+        self.assertIsNotNone(first)
+
+        self.client.get(reverse('get_unread_count'))
+        with self.assertNumQueries(0):
+            presence.flush()
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.last_activity, first)
+
+    def test_buffered_writes_get_a_flush_timer(self):
+        with mock.patch.object(presence, 'BACKGROUND_FLUSH', True), \
+                mock.patch('core.presence.threading.Timer') as timer:
+            presence.touch(self.user.id)
+            presence.touch(User.objects.create_user('other').id)
+            # One timer per batch, not per user
+            timer.assert_called_once_with(presence.FLUSH_INTERVAL, presence._background_flush)
+            presence._background_flush()
+        self.assertIsNone(presence._timer)
+        self.assertIsNotNone(Profile.objects.get(user=self.user).last_activity)
+
+    def test_last_seen_is_cached_once_per_interval(self):
+        start = timezone.now().replace(microsecond=0)
+        presence.touch(self.user.id, now=start)
+        presence.touch(self.user.id, now=start + timedelta(seconds=1))
+        self.assertEqual(presence.last_seen(self.user.id), start)
+        later = start + timedelta(seconds=presence.SEEN_INTERVAL)
+        presence.touch(self.user.id, now=later)
+        self.assertEqual(presence.last_seen(self.user.id), later)
+
+    def test_is_online_reads_cache_before_column(self):
+        profile = self.user.profile
+        self.assertFalse(profile.is_online)
+        presence.touch(self.user.id)
+        self.assertIsNone(Profile.objects.get(id=profile.id).last_activity)
+        self.assertTrue(profile.is_online)
+
+
+class RealtimeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_broker_delivers_to_subscribers_only(self):
+        broker = realtime.InProcessBroker()
+
+        async def scenario():
+            queue = broker.subscribe(1)
+            broker.publish(1, 'unread_count', {'count': 2})
+            broker.publish(2, 'unread_count', {'count': 9})
+            message = await asyncio.wait_for(queue.get(), timeout=1)
+            broker.unsubscribe(1, queue)
+            return message, queue.empty(), broker.has_subscribers(1)
+
+        self.assertEqual(asyncio.run(scenario()), (('unread_count', {'count': 2}), True, False))
+
+    def test_unopened_stream_leaves_no_subscription(self):
+        user = User.objects.create_user('listener', password='pw')
+        request = AsyncRequestFactory().get(reverse('event_stream'))
+        request.user = user
+        broker = realtime.InProcessBroker()
+
+        async def scenario():
+            response = await views.event_stream(request)
+            # Client went away before the first chunk was sent
+            await response.streaming_content.aclose()
+            return response.status_code
+
+        with mock.patch.object(realtime, 'get_broker', return_value=broker):
+            self.assertEqual(asyncio.run(scenario()), 200)
+        self.assertFalse(broker.has_subscribers(user.id))
+
+    def test_stream_is_skipped_under_wsgi(self):
+        user = User.objects.create_user('listener', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('event_stream')).status_code, 204)
+
+
+class ReadReceiptTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me', password='pw')
+        self.friend = User.objects.create_user('friend', password='pw')
+        self.client.force_login(self.me)
+
+    def participant(self, user):
+        return ConversationParticipant.objects.get(user=user)
+
+    def test_unread_messages_marked_read_in_one_update(self):
+        for i in range(5):
+            Message.objects.create(sender=self.friend, receiver=self.me, content=f'm{i}')
+        self.assertEqual(self.participant(self.me).unread_count, 5)
+        self.assertEqual(self.client.get(reverse('get_unread_count')).json(), {'count': 1})
+        url = reverse('get_messages_ajax', args=[self.friend.username])
+
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(url).json()
+        self.assertEqual([m['content'] for m in data['messages']], [f'm{i}' for i in range(5)])
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        me = self.participant(self.me)
+        self.assertEqual((me.unread_count, me.last_read_message_id), (0, Message.objects.latest('id').id))
+        self.assertEqual(self.client.get(url).json()['messages'], [])
+        self.assertEqual(self.client.get(reverse('get_unread_count')).json(), {'count': 0})
+
+    def test_read_cursor_never_skips_newer_messages(self):
+        first = Message.objects.create(sender=self.friend, receiver=self.me, content='a')
+        Message.objects.create(sender=self.friend, receiver=self.me, content='b')
+        mark_read(first.conversation_id, self.me.id, first.id)
+        self.assertEqual(self.participant(self.me).unread_count, 1)
+        # A stale, lower high-water mark must not move the cursor back
+        mark_read(first.conversation_id, self.me.id, 0)
+        self.assertEqual(self.participant(self.me).last_read_message_id, first.id)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_inbox_ordered_by_latest_message_with_preview(self):
+        me = User.objects.create_user('me', password='pw')
+        others = [User.objects.create_user(f'other{i}', password='pw') for i in range(3)]
+        for other in others:
+            Message.objects.create(sender=other, receiver=me, content=f'hi from {other.username}')
+        Message.objects.create(sender=me, receiver=others[0], content='latest')
+
+        entries, next_cursor = inbox_page(me.id, limit=2)
+        self.assertEqual([e.partner for e in entries], [others[0], others[2]])
+        self.assertEqual(entries[0].conversation.last_message_preview, 'latest')
+        rest, _ = inbox_page(me.id, cursor=next_cursor, limit=2)
+        self.assertEqual([e.partner for e in rest], [others[1]])
+
+        self.client.force_login(me)
+        response = self.client.get(reverse('chat'))
+        self.assertEqual(len(response.context['inbox']), 3)
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_chat_loads_latest_page_and_scrolls_back(self):
+        me = User.objects.create_user('me', password='pw')
+        friend = User.objects.create_user('friend', password='pw')
+        for i in range(CHAT_PAGE_SIZE + 5):
+            Message.objects.create(sender=friend if i % 2 else me, receiver=me if i % 2 else friend, content=f'm{i}')
+        self.client.force_login(me)
+
+        response = self.client.get(reverse('chat_with_user', args=[friend.username]))
+        page = response.context['chat_messages']
+        self.assertEqual(len(page), CHAT_PAGE_SIZE)
+        self.assertEqual(page[-1].content, f'm{CHAT_PAGE_SIZE + 4}')
+        self.assertTrue(response.context['has_older_messages'])
+
+        older = self.client.get(reverse('chat_history_ajax', args=[friend.username]), {'before': page[0].id}).json()
+        self.assertFalse(older['has_more'])
+        self.assertEqual(older['html'].count('class="message '), 5)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(TestCase):
+    """Every SELECT behind the hot views must be served by an index."""
+
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me', password='pw')
+        self.friend = User.objects.create_user('friend', password='pw')
+        for i in range(3):
+            post = Post.objects.create(user=self.friend, content=f'post {i}', image=f'post_images/{i}.jpg')
+            Comment.objects.create(post=post, user=self.me, content='nice')
+            post.likes.add(self.me)
+        Post.objects.create(user=self.me, content='note to self', visibility='private')
+        for i in range(3):
+            Message.objects.create(sender=self.friend, receiver=self.me, content=f'm{i}')
+        FriendRequest.objects.create(from_user=self.friend, to_user=self.me)
+        self.client.force_login(self.me)
+
+    def test_timeline_reads_use_indexes(self):
+        cache.clear()
+        Friendship.befriend(self.me.id, self.friend.id)
+        self.test_hot_views_avoid_full_scans()
+
+    def plan_problems(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            details = [row[3] for row in cursor.fetchall()]
+        # Scanning a subquery's own result rows is fine, scanning a table isn't
+        allowed = {m.group(1) for d in details if (m := re.match(r'(?:CO-ROUTINE|MATERIALIZE) (.+)', d))}
+        # ...unless it walks the primary key in order and stops at a LIMIT
+        if re.search(r'ORDER BY "(\w+)"\."id" (?:ASC|DESC) LIMIT \d+$', sql):
+            allowed.update(re.findall(r'FROM "(\w+)"', sql))
+        return [
+            d for d in details
+            if (d.startswith('SCAN ') and 'USING' not in d and 'VIRTUAL TABLE' not in d and d[5:] not in allowed)
+            # Sorting aggregated groups (e.g. by a count) can't come from an index
+            or (d == 'USE TEMP B-TREE FOR ORDER BY' and 'GROUP BY' not in sql)
+        ]
+
+    def test_hot_views_avoid_full_scans(self):
+        urls = [
+            reverse('friends'),
+            reverse('home'),
+            reverse('feed_page'),
+            reverse('profile', args=[self.friend.username]),
+            reverse('profile_media', args=[self.friend.username, 'photos']) + '?limit=2',
+            reverse('chat_with_user', args=[self.friend.username]),
+            reverse('get_messages_ajax', args=[self.friend.username]),
+            reverse('chat_history_ajax', args=[self.friend.username]) + '?before=1000',
+            reverse('inbox_page_ajax'),
+            reverse('get_unread_count'),
+            reverse('get_friend_request_count'),
+            reverse('send_friend_request', args=[self.friend.username]),
+            reverse('search') + '?q=post&type=all',
+            reverse('search') + '?q=frie&type=people',
+            reverse('search') + '?q=post&type=photos',
+        ]
+        for url in urls:
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+            for query in ctx.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                # Captured SQL has its parameters inlined already
+                problems = self.plan_problems(query['sql'], ())
+                self.assertEqual(problems, [], f'{url}: {query["sql"]}')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me', password='pw')
+        self.client.force_login(self.me)
+
+    def test_people_ranked_by_username_over_bio(self):
+        bio_hit = User.objects.create_user('zed', password='pw')
+        bio_hit.profile.bio = 'Photographer and hiker'
+        bio_hit.profile.save()
+        name_hit = User.objects.create_user('photon_fan', password='pw')
+
+        users, _ = search_users('phot', exclude_id=self.me.id)
+        self.assertEqual(users, [name_hit, bio_hit])
+
+        name_hit.username = 'renamed'
+        name_hit.save()
+        self.assertEqual(search_users('phot')[0], [bio_hit])
+        bio_hit.delete()
+        self.assertEqual(search_users('phot')[0], [])
+
+    def test_posts_prefix_match_visibility_and_paging(self):
+        for i in range(5):
+            Post.objects.create(user=self.me, content=f'Sunset number {i}', image='post_images/s.jpg' if i % 2 else '')
+        hidden = Post.objects.create(user=self.me, content='sunset secret', visibility='private')
+
+        posts, has_next = search_posts('SUNS num', limit=3)
+        self.assertEqual((len(posts), has_next), (3, True))
+        rest, has_next = search_posts('suns num', page=2, limit=3)
+        self.assertEqual((len(rest), has_next), (2, False))
+        self.assertNotIn(hidden, posts + rest)
+        self.assertEqual(len(search_posts('sunset', kind='photos')[0]), 2)
+
+        edited = posts[0]
+        edited.content = 'Sunrise instead'
+        edited.save()
+        self.assertNotIn(edited, search_posts('sunset')[0])
+        # FTS syntax in user input is treated as plain text
+        self.assertEqual(search_posts('"sunris* (')[0], [edited])
+
+        response = self.client.get(reverse('search'), {'q': 'sunset', 'type': 'posts', 'page': 'x'})
+        self.assertEqual(len(response.context['posts']), 4)
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_prefix_lookup_follows_user_changes(self):
+        for name in ['alice', 'Alfred', 'bob', 'albert']:
+            User.objects.create_user(name, password='pw')
+        index = UsernameIndex()
+        self.assertEqual([n for _, n in index.suggest('AL')], ['albert', 'Alfred', 'alice'])
+        self.assertEqual(index.suggest('al', limit=1)[0][1], 'albert')
+
+        bob = User.objects.get(username='bob')
+        index.update(bob.id, 'alan')
+        self.assertEqual([n for _, n in index.suggest('ala')], ['alan'])
+        self.assertEqual(index.suggest('bo'), [])
+        index.remove(bob.id)
+        self.assertEqual(index.suggest('ala'), [])
+
+    def test_endpoint_answers_without_queries(self):
+        me = User.objects.create_user('me', password='pw')
+        self.client.force_login(me)
+        usernames.reload()
+        # Picked up from the post_save signal, not a reload
+        User.objects.create_user('zelda', password='pw')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('search_suggest'), {'q': '@ZEL'})
+        # Only the session/auth lookups every request makes
+        self.assertFalse([q for q in ctx.captured_queries if 'username' in q['sql'] and 'LIMIT 21' not in q['sql']])
+        self.assertEqual(response.json()['results'], [{'username': 'zelda', 'url': reverse('profile', args=['zelda'])}])
+
+
+class FriendSuggestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me, self.a, self.b, self.c, self.d = [
+            User.objects.create_user(name, password='pw') for name in ['me', 'a', 'b', 'c', 'd']
+        ]
+        self.befriend(self.me, self.a)
+        self.befriend(self.me, self.b)
+        self.befriend(self.a, self.c)
+        self.befriend(self.b, self.c)
+        self.befriend(self.a, self.d)
+
+    def befriend(self, x, y):
+        Friendship.befriend(x.id, y.id)
+
+    def test_ranked_by_mutual_friends_and_cached(self):
+        users, has_next = recommendations.suggestions_page(self.me.id)
+        self.assertEqual([(u, u.mutual_count) for u in users], [(self.c, 2), (self.d, 1)])
+        self.assertFalse(has_next)
+        # Served from the cache: only the hydration query
+        with self.assertNumQueries(1):
+            recommendations.suggestions_page(self.me.id)
+
+        page, has_next = recommendations.suggestions_page(self.me.id, per_page=1)
+        self.assertEqual((page, has_next), ([self.c], True))
+
+    def test_accepting_a_request_invalidates(self):
+        recommendations.suggestions_page(self.me.id)
+        self.client.force_login(self.c)
+        self.client.get(reverse('send_friend_request', args=['me']))
+        self.client.force_login(self.me)
+        response = self.client.get(reverse('friends'))
+        self.assertEqual(response.context['suggestions'], [self.d])
+
+        request_id = response.context['friend_requests'][0].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('accept_friend_request', args=[request_id]))
+        self.assertEqual(recommendations.suggestions_page(self.me.id)[0], [self.d])
+        self.assertEqual(recommendations.suggestions_page(self.c.id)[0], [self.d])
+
+
+class FriendshipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_single_row_per_pair(self):
+        me = User.objects.create_user('me', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        self.client.force_login(other)
+        self.client.get(reverse('send_friend_request', args=['me']))
+        self.client.force_login(me)
+        request_id = FriendRequest.objects.get().id
+
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('accept_friend_request', args=[request_id]))
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 1)
+        self.assertEqual(Friendship.objects.get().user_low, me)
+        self.assertTrue(Friendship.are_friends(other.id, me.id))
+        self.assertEqual(list(other.profile.friends), [me])
+        self.assertEqual(self.client.get(reverse('send_friend_request', args=['other'])).json()['message'], 'Already friends')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(reverse('remove_friend', args=['other'])).json()['status'], 'success')
+        self.assertFalse(Friendship.are_friends(me.id, other.id))
+        self.assertEqual(self.client.get(reverse('remove_friend', args=['other'])).json()['status'], 'error')
+
+
+class SocialGraphCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me, self.a, self.b = [User.objects.create_user(n, password='pw') for n in ['me', 'a', 'b']]
+        Friendship.befriend(self.me.id, self.a.id)
+        Friendship.befriend(self.b.id, self.a.id)
+
+    def test_helpers_cache_and_invalidate(self):
+        self.assertEqual(list(graph.friends_of(self.a.id)), [self.me.id, self.b.id])
+        with self.assertNumQueries(0):
+            self.assertTrue(graph.are_friends(self.a.id, self.me.id))
+            self.assertFalse(graph.are_friends(self.a.id, self.a.id))
+        self.assertEqual(graph.mutual_count(self.me.id, self.b.id), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.unfriend(self.a.id, self.b.id)
+        self.assertFalse(graph.are_friends(self.a.id, self.b.id))
+        self.assertEqual(graph.mutual_count(self.me.id, self.b.id), 0)
+
+    def test_invalidation_waits_for_commit(self):
+        self.assertFalse(graph.are_friends(self.me.id, self.b.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Friendship.befriend(self.me.id, self.b.id)
+                # Another request reading before the commit still sees the old table
+                with mock.patch.object(graph, '_load', return_value=array('q', [self.a.id])):
+                    self.assertFalse(graph.are_friends(self.me.id, self.b.id))
+        self.assertTrue(graph.are_friends(self.me.id, self.b.id))
+
+    def test_profile_view_has_no_graph_queries_on_hit(self):
+        self.client.force_login(self.me)
+        url = reverse('profile', args=['a'])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertTrue(response.context['is_friend'])
+        self.assertEqual(response.context['mutual_friends'], 0)
+        self.assertFalse([q for q in ctx.captured_queries if 'core_friendship' in q['sql']])
+
+
+class TimelineTests(TestCase):
+    # Tasks run inline here (TASKS_EAGER), so fan-out is immediate
+    def setUp(self):
+        cache.clear()
+        self.me, self.friend, self.stranger = [
+            User.objects.create_user(n, password='pw') for n in ['me', 'friend', 'stranger']
+        ]
+        Friendship.befriend(self.me.id, self.friend.id)
+        self.client.force_login(self.me)
+
+    def post(self, user, content, **kwargs):
+        return Post.objects.create(user=user, content=content, **kwargs)
+
+    def test_posts_fan_out_to_friends(self):
+        mine = self.post(self.me, 'mine', visibility='private')
+        theirs = self.post(self.friend, 'theirs')
+        self.post(self.friend, 'hidden', visibility='private')
+        elsewhere = self.post(self.stranger, 'elsewhere')
+
+        self.assertEqual(set(TimelineEntry.objects.filter(user=self.me).values_list('post_id', flat=True)), {mine.id, theirs.id})
+        # Home is the timeline: strangers' public posts aren't on it
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['posts'], [theirs, mine])
+
+        first, cursor = timeline.home_page(self.me, limit=1)
+        rest, end = timeline.home_page(self.me, cursor=cursor, limit=1)
+        self.assertEqual((first, rest, end), ([theirs], [mine], None))
+        # Users without friends get the public feed instead
+        self.assertEqual(timeline.home_page(self.stranger)[0], [elsewhere, theirs])
+
+    def test_posts_made_public_are_fanned_out(self):
+        post = self.post(self.friend, 'draft', visibility='private')
+        self.assertFalse(TimelineEntry.objects.filter(user=self.me, post=post).exists())
+        post.visibility = 'public'
+        post.save()
+        self.assertTrue(TimelineEntry.objects.filter(user=self.me, post=post).exists())
+
+    def test_trim_keeps_newest(self):
+        posts = [self.post(self.friend, f'p{i}') for i in range(5)]
+        timeline.trim([self.me.id, self.friend.id], max_length=2)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.me).order_by('-created_at', '-post_id').values_list('post_id', flat=True)),
+            [posts[4].id, posts[3].id],
+        )
+        self.assertEqual(TimelineEntry.objects.filter(user=self.friend).count(), 2)
+
+    def test_high_fanout_authors_are_merged_on_read(self):
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0):
+            older = self.post(self.me, 'mine')
+            newer = self.post(self.friend, 'big account')
+            self.assertFalse(TimelineEntry.objects.filter(user=self.me, post=newer).exists())
+            posts, _ = timeline.home_page(self.me)
+        self.assertEqual(posts, [newer, older])
+
+    def test_friendship_changes_update_timelines(self):
+        earlier = self.post(self.stranger, 'before we met')
+        freq = FriendRequest.objects.create(from_user=self.stranger, to_user=self.me)
+        self.client.get(reverse('accept_friend_request', args=[freq.id]))
+        self.assertIn(earlier, timeline.home_page(self.me)[0])
+
+        self.client.get(reverse('remove_friend', args=['stranger']))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.me, post=earlier).exists())
+
+
+calls = []
+
+
+@tasks.task(name='tests.record', max_attempts=2)
+def record(value):
+    if value == 'boom':
+        raise ValueError(value)
+    calls.append(value)
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        calls.clear()
+
+    def test_jobs_run_by_worker(self):
+        job = record.delay('a')
+        self.assertEqual((job.name, job.args, job.status), ('tests.record', ['a'], Job.QUEUED))
+        self.assertEqual(calls, [])
+        out = StringIO()
+        call_command('run_worker', once=True, stdout=out)
+        self.assertEqual(calls, ['a'])
+        self.assertIn('Ran 1 job', out.getvalue())
+        self.assertFalse(Job.objects.exists())
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = record.delay('boom')
+        tasks.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('ValueError', job.last_error)
+        # Backed off: not due yet
+        self.assertEqual(tasks.run_pending(), 0)
+
+        Job.objects.update(run_at=job.created_at)
+        tasks.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_full_queue_runs_inline(self):
+        with mock.patch.object(tasks, 'QUEUE_MAX_DEPTH', 0):
+            self.assertIsNone(record.delay('now'))
+        self.assertEqual(calls, ['now'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_running_jobs_are_requeued(self):
+        record.delay('b')
+        tasks.claim('dead-worker', 10)
+        Job.objects.update(locked_at=timezone.now() - tasks.LOCK_TIMEOUT * 2)
+        self.assertEqual(tasks.release_stale(), 1)
+        tasks.run_pending()
+        self.assertEqual(calls, ['b'])
+
+    def test_jobs_that_keep_losing_their_worker_fail(self):
+        job = record.delay('c')
+        for expected in (1, 0):
+            tasks.claim('dead-worker', 10)
+            Job.objects.update(locked_at=timezone.now() - tasks.LOCK_TIMEOUT * 2)
+            self.assertEqual(tasks.release_stale(), expected)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(tasks.run_pending(), 0)
+
+
+def jpeg_with_exif(size):
+    exif = Image.Exif()
+    exif[0x010F] = 'TestCam'  # Make
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees when displayed
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def use_temp_media(test):
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    settings_override = override_settings(MEDIA_ROOT=media_root)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return media_root
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        use_temp_media(self)
+        self.user = User.objects.create_user('pic', password='x')
+
+    def open_variant(self, path):
+        with default_storage.open(path, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+        return image
+
+    def test_post_image_variants(self):
+        post = Post.objects.create(
+            user=self.user, image=SimpleUploadedFile('photo.jpg', jpeg_with_exif((3000, 1500)), 'image/jpeg'),
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['source'], post.image.name)
+        self.assertEqual(MediaBlob.objects.get(name=post.image_variants['720']['webp']).refcount, 1)
+        for width in ('720', '1080'):
+            jpeg = self.open_variant(post.image_variants[width]['jpeg'])
+            webp = self.open_variant(post.image_variants[width]['webp'])
+            # Orientation applied (portrait now), metadata gone
+            self.assertEqual(jpeg.size, (int(width), int(width) * 2))
+            self.assertEqual((jpeg.format, webp.format), ('JPEG', 'WEBP'))
+            self.assertEqual(len(jpeg.getexif()), 0)
+            self.assertNotIn('exif', webp.info)
+        self.assertRegex(post.image_url(720), r'/media/blobs/.*[0-9a-f]{64}\.jpg$')
+
+    def test_original_is_stored_without_metadata(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif.get_ifd(0x8825)[2] = (51.0, 30.0, 0.0)  # GPSLatitude
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(buffer, 'JPEG', exif=exif, comment=b'secret')
+        post = Post.objects.create(user=self.user, image=SimpleUploadedFile('gps.jpg', buffer.getvalue(), 'image/jpeg'))
+
+        original = self.open_variant(post.image.name)
+        # Only the orientation survives, so it still displays upright
+        self.assertEqual(dict(original.getexif()), {0x0112: 6})
+        self.assertNotIn('comment', original.info)
+        self.assertEqual(original.size, (40, 20))
+
+    def test_small_images_are_not_upscaled(self):
+        post = Post.objects.create(
+            user=self.user, image=SimpleUploadedFile('small.jpg', jpeg_with_exif((300, 200)), 'image/jpeg'),
+        )
+        post.refresh_from_db()
+        self.assertEqual(self.open_variant(post.image_variants['1080']['jpeg']).size, (200, 300))
+
+    def test_profile_variants_and_fallback(self):
+        profile = self.user.profile
+        self.assertEqual(profile.picture_variants, {})
+        self.assertEqual(profile.profile_picture_url(64), profile.get_profile_picture_url)
+
+        profile.profile_picture = SimpleUploadedFile('me.jpg', jpeg_with_exif((400, 300)), 'image/jpeg')
+        profile.cover_photo = SimpleUploadedFile('cover.jpg', jpeg_with_exif((3000, 2000)), 'image/jpeg')
+        profile.save()
+        profile.refresh_from_db()
+        self.assertEqual(self.open_variant(profile.picture_variants['64']['jpeg']).size, (64, 64))
+        self.assertEqual(self.open_variant(profile.picture_variants['128']['webp']).size, (128, 128))
+        self.assertEqual(self.open_variant(profile.cover_variants['cover']['jpeg']).size, (1500, 500))
+        self.assertRegex(profile.profile_picture_url(64, 'webp'), r'/media/blobs/.*[0-9a-f]{64}\.webp$')
+
+        # Saving again without a new upload doesn't regenerate
+        with mock.patch('core.images.render_variants') as render:
+            profile.save()
+        render.assert_not_called()
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = use_temp_media(self)
+        self.user = User.objects.create_user('uploader', password='x')
+        self.friend = User.objects.create_user('receiver', password='x')
+        self.client.force_login(self.user)
+        self.data = os.urandom(2500)
+
+    def start(self, purpose=ChunkedUpload.POST_VIDEO, **extra):
+        response = self.client.post(reverse('upload_start'), {
+            'purpose': purpose, 'filename': '../clip.mp4', 'size': len(self.data), **extra,
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()['upload_id']
+
+    def put(self, upload_id, start, end, body=None, **headers):
+        return self.client.put(
+            reverse('upload_chunk', args=[upload_id]), body if body is not None else self.data[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.data)}', **headers,
+        )
+
+    def test_chunks_resume_and_attach_to_post(self):
+        upload_id = self.start(checksum=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.put(upload_id, 0, 1000).json()['offset'], 1000)
+        # Out-of-order chunk is refused and reports where to resume
+        response = self.put(upload_id, 2000, 2500)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 1000))
+        self.assertEqual(self.client.get(reverse('upload_chunk', args=[upload_id])).json()['offset'], 1000)
+        # A chunk that fails its checksum isn't accepted; the resend overwrites it
+        response = self.put(upload_id, 1000, 2000, HTTP_X_CHUNK_CHECKSUM='0' * 64)
+        self.assertEqual((response.status_code, response.json()['offset']), (400, 1000))
+        # Nor is a bad Content-Length
+        response = self.put(upload_id, 1000, 2000, HTTP_CONTENT_LENGTH='1e3')
+        self.assertEqual(response.status_code, 400)
+
+        self.put(upload_id, 1000, 2000, HTTP_X_CHUNK_CHECKSUM=hashlib.sha256(self.data[1000:2000]).hexdigest())
+        self.put(upload_id, 2000, 2500)
+        response = self.client.post(reverse('upload_complete', args=[upload_id]), {'content': 'my clip'})
+        post = Post.objects.get(id=response.json()['post_id'])
+        self.assertEqual(post.content, 'my clip')
+        self.assertEqual(post.video.name, blob_name(hashlib.sha256(self.data).hexdigest(), '.mp4'))
+        with post.video.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+    def test_incomplete_or_corrupt_uploads_are_refused(self):
+        upload_id = self.start(checksum='0' * 64)
+        self.put(upload_id, 0, 2000)
+        response = self.client.post(reverse('upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 409)
+
+        self.put(upload_id, 2000, 2500)
+        response = self.client.post(reverse('upload_complete', args=[upload_id]))
+        self.assertEqual(response.json()['message'], 'Checksum mismatch, upload discarded')
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertFalse(Post.objects.exists())
+
+    def test_failed_duplicate_keeps_accepted_bytes(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, 1000)
+        upload = ChunkedUpload.objects.get()
+        self.put(upload_id, 1000, 2000)
+        # A retry of the second chunk that was still holding the old offset fails midway
+        upload.offset = 1000
+        with self.assertRaises(uploads.UploadError):
+            uploads.write_chunk(upload, 1000, 1000, BytesIO(self.data[1000:1500]))
+        self.assertEqual(os.path.getsize(uploads.part_path(upload)), 2000)
+
+        self.put(upload_id, 2000, 2500)
+        self.assertEqual(self.client.post(reverse('upload_complete', args=[upload_id])).status_code, 200)
+
+    def test_short_file_is_refused(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, 2500)
+        with open(uploads.part_path(ChunkedUpload.objects.get()), 'r+b') as f:
+            f.truncate(2000)
+        response = self.client.post(reverse('upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Post.objects.exists())
+
+    def test_other_users_cannot_touch_an_upload(self):
+        upload_id = self.start()
+        self.client.force_login(self.friend)
+        self.assertEqual(self.put(upload_id, 0, 1000).status_code, 404)
+
+    def test_message_file(self):
+        upload_id = self.start(ChunkedUpload.MESSAGE_FILE)
+        self.put(upload_id, 0, 2500)
+        response = self.client.post(
+            reverse('upload_complete', args=[upload_id]), {'to_user': 'receiver', 'content': 'see attached'},
+        ).json()
+        self.assertEqual((response['status'], response['file_name']), ('success', 'clip.mp4'))
+        message = Message.objects.get()
+        self.assertEqual(message.receiver, self.friend)
+        self.assertEqual(message.file.name, blob_name(hashlib.sha256(self.data).hexdigest(), '.mp4'))
+
+
+class VideoStreamingTests(TestCase):
+    def setUp(self):
+        media_root = use_temp_media(self)
+        os.makedirs(os.path.join(media_root, 'post_videos'))
+        self.data = bytes(range(256)) * 40
+        with open(os.path.join(media_root, 'post_videos', 'clip.mp4'), 'wb') as f:
+            f.write(self.data)
+        self.url = '/media/post_videos/clip.mp4'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_and_ranged_responses(self):
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response['Content-Length']), (200, str(len(self.data))))
+        self.assertEqual(self.body(response), self.data)
+
+        for header, first, last in [('bytes=100-199', 100, 199), ('bytes=10000-', 10000, 10239),
+                                    ('bytes=-40', 10200, 10239), ('bytes=10200-99999', 10200, 10239)]:
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {first}-{last}/{len(self.data)}')
+            self.assertEqual(response['Content-Length'], str(last - first + 1))
+            self.assertEqual(self.body(response), self.data[first:last + 1])
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.data)}'))
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=-0').status_code, 416)
+        # Multiple ranges aren't supported, so the whole file is sent
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+
+    def test_conditional_requests(self):
+        etag = self.client.head(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        # Stale validator: the file changed, so send all of it
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_head_and_missing_files(self):
+        response = self.client.head(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual((response.status_code, response['Content-Length'], response.content), (206, '10', b''))
+        self.assertEqual(self.client.get('/media/post_videos/nope.mp4').status_code, 404)
+        self.assertEqual(self.client.get('/media/post_videos/../../settings.mp4').status_code, 400)
+
+    def test_offload_to_proxy(self):
+        with mock.patch.object(media, 'MEDIA_OFFLOAD', 'x-accel-redirect'):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/post_videos/clip.mp4')
+        self.assertEqual(response.content, b'')
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = use_temp_media(self)
+        self.user = User.objects.create_user('saver', password='x')
+
+    def upload(self, data, name='a.jpg'):
+        return SimpleUploadedFile(name, data)
+
+    def blob(self, name):
+        return MediaBlob.objects.get(name=name)
+
+    def test_same_bytes_are_stored_once(self):
+        first = default_storage.save('post_images/a.jpg', self.upload(b'one'))
+        again = default_storage.save('chat_files/b.JPG', self.upload(b'one'))
+        other = default_storage.save('post_images/a.jpg', self.upload(b'two'))
+        self.assertEqual(first, blob_name(hashlib.sha256(b'one').hexdigest(), '.jpg'))
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertEqual(MediaBlob.objects.count(), 2)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'blobs', 'tmp')), [])
+
+    def test_refcounts_follow_rows_and_gc_removes_orphans(self):
+        post = Post.objects.create(user=self.user, video=self.upload(b'video', 'v.mp4'))
+        share = Post.objects.create(user=self.user, video=self.upload(b'video', 'copy.mp4'))
+        self.assertEqual(post.video.name, share.video.name)
+        self.assertEqual(self.blob(post.video.name).refcount, 2)
+
+        profile = self.user.profile
+        profile.cover_photo = self.upload(b'cover-1', 'c.png')
+        profile.save()
+        old_cover = profile.cover_photo.name
+        profile.cover_photo = self.upload(b'cover-2', 'c.png')
+        profile.save()
+        self.assertEqual(self.blob(old_cover).refcount, 0)
+
+        post.delete()
+        self.assertEqual(self.blob(share.video.name).refcount, 1)
+
+        # Recent orphans are kept for the grace period
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(default_storage.exists(old_cover))
+        out = StringIO()
+        call_command('gc_media', grace_hours=0, stdout=out)
+        self.assertIn('1 blob(s) removed', out.getvalue())
+        self.assertFalse(default_storage.exists(old_cover))
+        self.assertFalse(MediaBlob.objects.filter(name=old_cover).exists())
+        self.assertTrue(default_storage.exists(share.video.name))
+
+    def test_recount_repairs_drift(self):
+        post = Post.objects.create(user=self.user, video=self.upload(b'video', 'v.mp4'))
+        MediaBlob.objects.update(refcount=0)
+        self.assertEqual(blobs.recount(), 1)
+        self.assertEqual(self.blob(post.video.name).refcount, 1)
+
+    def test_blob_names_are_immutable(self):
+        name = default_storage.save('post_images/a.jpg', self.upload(b'data'))
+        response = self.client.get(default_storage.url(name))
+        self.assertEqual(response['Cache-Control'], f'public, max-age={media.IMMUTABLE_MAX_AGE}, immutable')
+        self.assertEqual(b''.join(response.streaming_content), b'data')
+
+        response = self.client.get(default_storage.url(name), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_legacy_names_revalidate(self):
+        os.makedirs(os.path.join(self.media_root, 'post_images'))
+        with open(os.path.join(self.media_root, 'post_images', 'old.jpg'), 'wb') as f:
+            f.write(b'old')
+        response = self.client.get('/media/post_images/old.jpg')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={media.MEDIA_CACHE_MAX_AGE}')
+        self.assertTrue(response.has_header('ETag'))
+
+
+class PostCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me, self.friend = [User.objects.create_user(n, password='pw') for n in ['me', 'friend']]
+        Friendship.befriend(self.me.id, self.friend.id)
+        self.post = Post.objects.create(user=self.me, content='first draft')
+
+    def test_card_body_is_cached_until_the_post_is_edited(self):
+        self.client.force_login(self.me)
+        self.assertContains(self.client.get(reverse('home')), 'first draft')
+
+        # A queryset update skips the version bump, so the cached fragment is still served
+        Post.objects.filter(id=self.post.id).update(content='sneaky')
+        self.assertNotContains(self.client.get(reverse('home')), 'sneaky')
+
+        self.client.post(reverse('edit_post', args=[self.post.id]), {'content': 'final', 'visibility': 'public'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'final')
+        self.assertNotContains(response, 'first draft')
+
+    def test_cached_card_is_reused_as_time_passes(self):
+        Post.objects.create(user=self.friend, content='look', shared_post=self.post)
+        self.client.force_login(self.me)
+        urls = [reverse('home'), reverse('profile', args=['friend'])]
+        for url in urls:
+            self.assertContains(self.client.get(url), 'first draft')
+
+        # An hour later the same fragments are served; only the "x ago" texts move
+        Post.objects.filter(id=self.post.id).update(
+            content='sneaky', created_at=F('created_at') - timedelta(hours=1),
+        )
+        for url in urls:
+            response = self.client.get(url)
+            self.assertNotContains(response, 'sneaky')
+            self.assertContains(response, '1\xa0hour ago')
+
+    def test_edit_keeps_a_concurrent_version_bump(self):
+        self.client.force_login(self.me)
+        is_valid = PostForm.is_valid
+
+        def variants_land_meanwhile(form):
+            Post.objects.filter(id=self.post.id).update(version=F('version') + 1, image_variants={'source': 'x'})
+            return is_valid(form)
+
+        with mock.patch.object(PostForm, 'is_valid', variants_land_meanwhile):
+            self.client.post(reverse('edit_post', args=[self.post.id]), {'content': 'final', 'visibility': 'public'})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.version, self.post.content, self.post.image_variants), (3, 'final', {'source': 'x'}))
+
+    def test_per_viewer_parts_stay_live(self):
+        self.post.likes.add(self.friend)
+        self.client.force_login(self.me)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, reverse('edit_post', args=[self.post.id]))
+        self.assertNotContains(response, 'btn-action-post liked')
+
+        self.client.force_login(self.friend)
+        response = self.client.get(reverse('home'))
+        self.assertNotContains(response, reverse('edit_post', args=[self.post.id]))
+        self.assertContains(response, 'btn-action-post liked')
+
+    def test_new_avatar_changes_the_key(self):
+        before = self.post.card_version
+        Profile.objects.filter(user=self.me).update(profile_picture='profile_pics/new.jpg')
+        self.assertNotEqual(Post.objects.get(id=self.post.id).card_version, before)
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def later(self, seconds):
+        return mock.patch('core.caching.time.monotonic', return_value=time.monotonic() + seconds)
+
+    def test_local_tier_serves_until_its_timeout(self):
+        cache.set('k', 'mine')
+        # Another worker changes the shared value; ours is served from the LRU for a few seconds
+        caches['shared'].set('k', 'theirs')
+        self.assertEqual(cache.get('k'), 'mine')
+        with self.later(60):
+            self.assertEqual(cache.get('k'), 'theirs')
+
+        cache.delete('k')
+        self.assertIsNone(cache.get('k'))
+        self.assertIsNone(caches['shared'].get('k'))
+
+    def test_local_tier_is_a_bounded_lru(self):
+        tiered = caching.TieredCache('lru-test', {'OPTIONS': {'SHARED': 'shared', 'MAX_ENTRIES': 2}})
+        for key in 'abc':
+            tiered.set(key, key)
+        self.assertEqual(list(tiered._local), [tiered.make_key('b'), tiered.make_key('c')])
+        # Evicted locally, still in the shared tier
+        self.assertEqual(tiered.get('a'), 'a')
+
+    def test_values_are_copies(self):
+        cache.set('ids', [1, 2])
+        cache.get('ids').append(3)
+        self.assertEqual(cache.get('ids'), [1, 2])
+
+    def test_get_or_set_many_computes_only_misses(self):
+        cache.set('n:1', 'one')
+        computed = []
+
+        def compute(missing):
+            computed.extend(missing)
+            return {i: str(i) for i in missing}
+
+        self.assertEqual(caching.get_or_set_many({'n:1': 1, 'n:2': 2}, compute), {1: 'one', 2: '2'})
+        self.assertEqual(computed, [2])
+        self.assertEqual(caches['shared'].get('n:2'), '2')
+
+    def test_namespace_invalidation(self):
+        ns = caching.Namespace('profile:1')
+        cache.set(ns.key('summary'), 'old')
+        self.assertEqual(cache.get(ns.key('summary')), 'old')
+        ns.invalidate()
+        self.assertIsNone(cache.get(ns.key('summary')))
+        self.assertIsNone(cache.get(caching.Namespace('profile:2').key('summary')))
+
+    def test_get_or_compute_refreshes_once_past_soft_expiry(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(caching.get_or_compute('hot', compute, 100), 1)
+        self.assertEqual(caching.get_or_compute('hot', compute, 100), 1)
+        with mock.patch('core.caching.time.time', return_value=time.time() + 90):
+            # Someone else is already recomputing: keep serving the old value
+            cache.add('lock:hot', 1)
+            self.assertEqual(caching.get_or_compute('hot', compute, 100), 1)
+            cache.delete('lock:hot')
+            self.assertEqual(caching.get_or_compute('hot', compute, 100), 2)
+        self.assertEqual(len(calls), 2)
+        self.assertIsNone(cache.get('lock:hot'))
+
+
+class ProfileSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me, self.friend = [User.objects.create_user(n, password='pw') for n in ['me', 'friend']]
+        self.photos = [Post.objects.create(user=self.me, content=f'p{i}', image=f'post_images/{i}.jpg') for i in range(3)]
+        Post.objects.create(user=self.me, content='clip', video='post_videos/clip.mp4')
+        Post.objects.create(user=self.me, content='secret', image='post_images/secret.jpg', visibility='private')
+
+    def test_counts_per_audience(self):
+        mine = profile_summary.summary(self.me.id, include_private=True)
+        public = profile_summary.summary(self.me.id)
+        self.assertEqual((mine['posts'], mine['photos'], mine['videos']), (5, 4, 1))
+        self.assertEqual((public['posts'], public['photos'], public['videos']), (4, 3, 1))
+        self.assertEqual(public['latest_photos'], [p.id for p in reversed(self.photos)])
+
+    def test_signals_invalidate(self):
+        self.assertEqual(profile_summary.summary(self.me.id)['friends'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.befriend(self.me.id, self.friend.id)
+        self.assertEqual(profile_summary.summary(self.me.id)['friends'], 1)
+        self.assertEqual(profile_summary.summary(self.friend.id)['friends'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.unfriend(self.me.id, self.friend.id)
+        self.assertEqual(profile_summary.summary(self.friend.id)['friends'], 0)
+
+        self.photos[0].delete()
+        self.assertEqual(profile_summary.summary(self.me.id)['photos'], 2)
+        Post.objects.create(user=self.me, content='new', image='post_images/new.jpg')
+        self.assertEqual(profile_summary.summary(self.me.id)['photos'], 3)
+
+    def test_profile_page_uses_cached_summary(self):
+        self.client.force_login(self.friend)
+        url = reverse('profile', args=[self.me.username])
+        self.client.get(url)
+        with mock.patch.object(profile_summary, '_compute') as compute:
+            response = self.client.get(url)
+        compute.assert_not_called()
+        self.assertEqual(response.context['summary']['posts'], 4)
+        self.assertEqual(len(response.context['latest_photos']), 3)
+        self.assertNotIn('post_images/secret.jpg', response.content.decode())
+
+    def test_media_tabs_paginate(self):
+        self.client.force_login(self.friend)
+        url = reverse('profile_media', args=[self.me.username, 'photos'])
+        first = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(first['html'].count('<img'), 2)
+        rest = self.client.get(url, {'limit': 2, 'cursor': first['next_cursor']}).json()
+        self.assertEqual(rest['html'].count('<img'), 1)
+        self.assertIsNone(rest['next_cursor'])
+        self.assertNotIn('secret', first['html'] + rest['html'])
+
+        videos = self.client.get(reverse('profile_media', args=[self.me.username, 'videos'])).json()
+        self.assertIn('post_videos/clip.mp4', videos['html'])
+        empty = self.client.get(reverse('profile_media', args=[self.friend.username, 'videos'])).json()
+        self.assertIn('No videos shared.', empty['html'])
+        self.assertEqual(self.client.get(reverse('profile_media', args=[self.me.username, 'posts'])).status_code, 404)
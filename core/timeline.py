@@ -0,0 +1,166 @@
+"""
+Materialized home timelines (fan-out on write).
+
+When a post is created (shares included), or an existing post is made
+public, it is delivered into TimelineEntry rows for the author and, if
+public, every friend of the author. Delivery is a background task
+(core.tasks), and each recipient's timeline is trimmed to
+TIMELINE_MAX_LENGTH entries.
+
+Authors with more than TIMELINE_FANOUT_LIMIT friends are not fanned out;
+readers pull their recent posts at read time and merge them in (fan-out on
+read), so one post never means an unbounded number of writes. Users with no
+friends yet get the public feed instead, so their home isn't empty.
+"""
+import heapq
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+from . import graph
+from .caching import get_or_compute
+from .feed import FEED_PAGE_SIZE, home_feed_queryset, paginate_posts, with_card_relations
+from .models import Friendship, Post, TimelineEntry
+from .pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from .tasks import task
+
+MAX_LENGTH = getattr(settings, 'TIMELINE_MAX_LENGTH', 800)
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 5000)
+FANOUT_BATCH_SIZE = 1000
+HIGH_FANOUT_CACHE_TIMEOUT = 10 * 60
+# Posts copied each way when two users become friends
+BACKFILL_LENGTH = 50
+
+def is_high_fanout(user_id):
+    return len(graph.friends_of(user_id)) > FANOUT_LIMIT
+
+
+def high_fanout_friends(user_id):
+    """Ids of user_id's friends over the fan-out limit, recounted every few minutes."""
+    return get_or_compute(
+        f'timeline:high_fanout:{user_id}', lambda: _count_high_fanout(user_id), HIGH_FANOUT_CACHE_TIMEOUT
+    )
+
+
+def _count_high_fanout(user_id):
+    # Friend counts for the viewer's friends only, batched under SQLite's variable limit
+    friends = list(graph.friends_of(user_id))
+    counts = Counter()
+    for start in range(0, len(friends), FANOUT_BATCH_SIZE):
+        batch = friends[start:start + FANOUT_BATCH_SIZE]
+        for column in ('user_low_id', 'user_high_id'):
+            rows = Friendship.objects.filter(**{f'{column}__in': batch}).order_by().values_list(column).annotate(n=Count('id'))
+            for friend_id, n in rows:
+                counts[friend_id] += n
+    return frozenset(uid for uid, n in counts.items() if n > FANOUT_LIMIT)
+
+
+@task
+def fan_out(post_id):
+    """Deliver a post to its author's and (if public) their friends' timelines."""
+    post = Post.objects.filter(id=post_id).values('user_id', 'visibility', 'created_at').first()
+    if post is None:
+        return  # Deleted before the fan-out ran
+    recipients = [post['user_id']]
+    if post['visibility'] == 'public' and not is_high_fanout(post['user_id']):
+        recipients.extend(graph.friends_of(post['user_id']))
+
+    for start in range(0, len(recipients), FANOUT_BATCH_SIZE):
+        batch = recipients[start:start + FANOUT_BATCH_SIZE]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=uid, post_id=post_id, created_at=post['created_at']) for uid in batch],
+            ignore_conflicts=True,
+        )
+        trim(batch)
+
+
+def trim(user_ids, max_length=MAX_LENGTH):
+    """Drop everything past the newest max_length entries, for all user_ids in one DELETE."""
+    overflow = TimelineEntry.objects.filter(user_id__in=user_ids).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('created_at').desc(), F('post_id').desc()],
+        )
+    ).filter(position__gt=max_length).values_list('id', flat=True)
+    ids = list(overflow)
+    if ids:
+        TimelineEntry.objects.filter(id__in=ids).delete()
+
+
+@task
+def backfill_pair(user_a_id, user_b_id):
+    """New friends: copy each one's recent public posts into the other's timeline."""
+    for reader, author in ((user_a_id, user_b_id), (user_b_id, user_a_id)):
+        if is_high_fanout(author):
+            continue  # Merged in at read time instead
+        posts = Post.objects.filter(user_id=author, visibility='public').order_by('-created_at', '-id')
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=reader, post_id=pid, created_at=ts)
+             for pid, ts in posts.values_list('id', 'created_at')[:BACKFILL_LENGTH]],
+            ignore_conflicts=True,
+        )
+        trim([reader])
+
+
+@task
+def remove_pair(user_a_id, user_b_id):
+    """Former friends: take each one's posts out of the other's timeline."""
+    TimelineEntry.objects.filter(
+        Q(user_id=user_a_id, post__user_id=user_b_id) | Q(user_id=user_b_id, post__user_id=user_a_id)
+    ).delete()
+
+
+def _keyset_rows(queryset, position, limit, date_field='created_at', id_field='id'):
+    """(created_at, post_id) rows after `position`, newest first."""
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__lt': timestamp}) | Q(**{date_field: timestamp, f'{id_field}__lt': pk})
+        )
+    return list(
+        queryset.order_by(f'-{date_field}', f'-{id_field}').values_list(date_field, id_field)[:limit]
+    )
+
+
+def _pull_rows(user_id, position, limit):
+    """Fan-out-on-read half: recent public posts by the viewer's high-fanout friends."""
+    authors = high_fanout_friends(user_id)
+    if not authors:
+        return []
+    return _keyset_rows(Post.objects.filter(user_id__in=authors, visibility='public'), position, limit)
+
+
+def home_page(user, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    One keyset page of the viewer's home timeline; returns (posts, next_cursor)
+    with the same cursor format as feed.paginate_posts. Users with no friends
+    yet get the public feed instead, so home isn't empty.
+    """
+    if not graph.friends_of(user.id):
+        return paginate_posts(home_feed_queryset(user), cursor=cursor, limit=limit)
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    position = decode_cursor(cursor)
+    pushed = _keyset_rows(TimelineEntry.objects.filter(user=user), position, limit + 1, id_field='post_id')
+    pulled = _pull_rows(user.id, position, limit + 1)
+
+    # Merge both newest-first streams; a post can be in both if it was
+    # delivered before its author crossed the fan-out limit
+    merged, seen = [], set()
+    for created_at, post_id in heapq.merge(pushed, pulled, reverse=True):
+        if post_id not in seen:
+            seen.add(post_id)
+            merged.append((created_at, post_id))
+
+    page, next_cursor = merged[:limit], None
+    if len(merged) > limit:
+        next_cursor = encode_cursor(*page[-1])
+    posts = with_card_relations(Post.objects.all()).in_bulk([post_id for _, post_id in page])
+    # A post made private after delivery stays in friends' timelines; hide it
+    return [
+        posts[post_id] for _, post_id in page
+        if post_id in posts and (posts[post_id].visibility == 'public' or posts[post_id].user_id == user.id)
+    ], next_cursor
@@ -0,0 +1,162 @@
+"""
+Resumable chunked uploads for post videos and chat files.
+
+A client starts an upload (name, size, optional SHA-256), PUTs the bytes in
+chunks of at most UPLOAD_CHUNK_SIZE with a Content-Range header, then
+completes it. Each chunk is streamed from the request straight into
+MEDIA_ROOT/uploads/<id>.part, so a big file is never buffered in memory or
+held in one long request. A client that loses its connection asks for the
+current offset and carries on from there. On completion the whole-file
+checksum is verified and the part file is moved (not copied) into the target
+field's upload_to directory. The views then attach it to a Post or Message.
+"""
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import ChunkedUpload, Message, Post
+
+CHUNK_SIZE = getattr(settings, 'UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024)
+MAX_SIZE = getattr(settings, 'UPLOAD_MAX_SIZE', 2 * 1024 * 1024 * 1024)
+EXPIRY = timedelta(seconds=getattr(settings, 'UPLOAD_EXPIRY', 24 * 60 * 60))
+READ_SIZE = 64 * 1024
+
+TARGET_FIELDS = {
+    ChunkedUpload.POST_VIDEO: Post._meta.get_field('video'),
+    ChunkedUpload.MESSAGE_FILE: Message._meta.get_field('file'),
+}
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class PartFile(File):
+    # FileSystemStorage moves files that have a temporary_file_path instead of
+    # copying them, which is what we want for a finished .part file
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{upload.id}.part')
+
+
+def start(user, purpose, filename, size, checksum=''):
+    if purpose not in TARGET_FIELDS:
+        raise UploadError('Unknown upload type')
+    if not 0 < size <= MAX_SIZE:
+        raise UploadError('File is empty or too large', status=413 if size > 0 else 400)
+    checksum = checksum.lower()
+    if checksum and not SHA256_RE.match(checksum):
+        raise UploadError('Checksum must be a hex SHA-256')
+
+    upload = ChunkedUpload.objects.create(
+        user=user, purpose=purpose, size=size, checksum=checksum,
+        filename=os.path.basename(filename)[:255] or 'upload',
+    )
+    os.makedirs(os.path.dirname(part_path(upload)), exist_ok=True)
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def parse_content_range(header):
+    """'bytes 0-99/1000' -> (offset, length, total)."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError('Missing or invalid Content-Range')
+    first, last, total = map(int, match.groups())
+    if last < first:
+        raise UploadError('Invalid Content-Range')
+    return first, last - first + 1, total
+
+
+def write_chunk(upload, offset, length, stream, chunk_checksum=''):
+    """Append `length` bytes read from `stream` at `offset`; returns the new offset."""
+    if offset != upload.offset:
+        raise UploadError(f'Expected a chunk starting at {upload.offset}', status=409)
+    if length > CHUNK_SIZE:
+        raise UploadError(f'Chunks are limited to {CHUNK_SIZE} bytes', status=413)
+    if offset + length > upload.size:
+        raise UploadError('Chunk runs past the declared size')
+
+    digest = hashlib.sha256()
+    with open(part_path(upload), 'r+b') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            f.write(data)
+            digest.update(data)
+            remaining -= len(data)
+    if remaining or (chunk_checksum and digest.hexdigest() != chunk_checksum.lower()):
+        # Nothing is truncated: `offset` may be stale (a duplicate retry) and
+        # cutting the file there would lose accepted bytes. The offset isn't
+        # advanced, so the resend overwrites whatever was written, and
+        # complete() checks the final size.
+        raise UploadError('Chunk was incomplete or failed its checksum')
+
+    # Only advance if a concurrent request for the same offset didn't get there first
+    advanced = ChunkedUpload.objects.filter(id=upload.id, offset=offset).update(
+        offset=offset + length, updated_at=timezone.now(),
+    )
+    if not advanced:
+        raise UploadError('Chunk was already received', status=409)
+    upload.offset = offset + length
+    return upload.offset
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE * 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete(upload):
+    """Verify the finished file and move it into place; returns its storage name."""
+    if upload.offset != upload.size:
+        raise UploadError(f'Upload incomplete: {upload.offset} of {upload.size} bytes', status=409)
+    path = part_path(upload)
+    if os.path.getsize(path) != upload.size:
+        discard(upload)
+        raise UploadError('File size does not match the upload, upload discarded')
+    if upload.checksum and file_sha256(path) != upload.checksum:
+        discard(upload)
+        raise UploadError('Checksum mismatch, upload discarded')
+
+    field = TARGET_FIELDS[upload.purpose]
+    with PartFile(open(path, 'rb'), name=upload.filename) as part:
+        name = default_storage.save(field.generate_filename(None, upload.filename), part)
+    discard(upload)
+    return name
+
+
+def discard(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge_stale():
+    """Remove uploads nobody has touched in UPLOAD_EXPIRY; returns how many."""
+    stale = list(ChunkedUpload.objects.filter(updated_at__lt=timezone.now() - EXPIRY))
+    for upload in stale:
+        discard(upload)
+    return len(stale)
@@ -1,8 +1,5 @@
-from django.urls import path, re_path
-from django.views.static import serve
+from django.urls import path
 from . import views
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
@@ -15,6 +12,7 @@ urlpatterns = [
     path('profile/update/bio/', views.update_bio_view, name='update_bio'),
     path('post/like/<int:post_id>/', views.like_post_view, name='like_post'),
     path('post/comment/add/', views.add_comment_ajax, name='add_comment_ajax'),
+    path('post/comments/<int:post_id>/', views.post_comments_ajax, name='post_comments_ajax'),
     path('post/edit/<int:post_id>/', views.edit_post_view, name='edit_post'),
     path('post/delete/<int:post_id>/', views.delete_post_view, name='delete_post'),
     path('post/share/<int:post_id>/', views.share_post_view, name='share_post'),
@@ -29,21 +27,27 @@ urlpatterns = [
     path('friend/requests/count/', views.get_friend_request_count, name='get_friend_request_count'),
     
     path('search/', views.search_view, name='search'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     
     # Messaging
     path('messages/', views.chat_view, name='chat'),
     path('messages/<str:username>/', views.chat_view, name='chat_with_user'),
     path('messages/send/ajax/', views.send_message_ajax, name='send_message_ajax'),
+    path('messages/inbox/page/', views.inbox_page_ajax, name='inbox_page_ajax'),
     path('messages/get/<str:username>/', views.get_messages_ajax, name='get_messages_ajax'),
+    path('messages/history/<str:username>/', views.chat_history_ajax, name='chat_history_ajax'),
     path('messages/unread/count/', views.get_unread_count, name='get_unread_count'),
+    path('events/', views.event_stream, name='event_stream'),
+
+    # Chunked uploads
+    path('upload/', views.upload_start, name='upload_start'),
+    path('upload/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    path('upload/<uuid:upload_id>/complete/', views.upload_complete, name='upload_complete'),
 
     
     path('profile/<str:username>/', views.profile_view, name='profile'),
+    path('profile/<str:username>/media/<str:kind>/', views.profile_media_page, name='profile_media'),
     path('home/', views.home, name='home'),
+    path('feed/page/', views.feed_page, name='feed_page'),
     path('offline/', views.offline, name='offline'),
 ]
-urlpatterns += [re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT})]
-urlpatterns += [re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT})]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,15 +1,31 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect, get_object_or_404
 from django.db.models import Q
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from .models import Profile, Post, Comment, FriendRequest
+from .models import ChunkedUpload, Post, Comment, FriendRequest, Friendship
 from .forms import UserUpdateForm, ProfileUpdateForm, PostForm
 from django.contrib import messages
-from .models import Message
-from django.db.models import Max, Exists, OuterRef
+from .models import Message, Conversation
+from .messaging import history_page, inbox_page, mark_read, unread_messages
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.urls import reverse
+from . import graph, profile_summary, realtime, timeline
+from .counters import bump, recount_likes
+from .feed import FEED_PAGE_SIZE, hydrate_posts, paginate_posts, with_card_relations
+from .search import MEDIA_FILTERS, search_posts, search_users
+from .suggest import usernames
+from . import media, recommendations, uploads
+
+REALTIME_HEARTBEAT = 15  # seconds between SSE keep-alive comments
+MEDIA_PAGE_SIZE = 12  # photos/videos per page on the profile tabs
 
 # ... (omitted previous functions until profile_view)
 
@@ -39,51 +55,36 @@ def profile_view(request, username):
     request_sent = False
     request_received = False
     request_received_id = None
+    mutual_friends = 0
     
     if not is_owner:
-        print(f"Checking friendship between {request.user.username} (ID: {request.user.id}) and {profile_user.username} (ID: {profile_user.id})")
-        # Explicit refresh of friends list to be sure
-        my_friends = request.user.profile.friends.all()
-        print(f"My friends: {[f.username for f in my_friends]}")
-        
-        if profile_user in my_friends:
-            print("is_friend is TRUE (found in list)")
-            is_friend = True
-        else:
-            print("is_friend is FALSE (not in list)")
-            
-        if FriendRequest.objects.filter(from_user=request.user, to_user=profile_user).exists():
+        is_friend = graph.are_friends(request.user.id, profile_user.id)
+        mutual_friends = graph.mutual_count(request.user.id, profile_user.id)
+
+        # Pending requests either way, in one query
+        pending = dict(FriendRequest.objects.filter(
+            Q(from_user=request.user, to_user=profile_user) | Q(from_user=profile_user, to_user=request.user)
+        ).values_list('from_user_id', 'id'))
+        if request.user.id in pending:
             request_sent = True
-        else:
-            incoming_req = FriendRequest.objects.filter(from_user=profile_user, to_user=request.user).first()
-            if incoming_req:
-                request_received = True
-                request_received_id = incoming_req.id
-
-    posts = profile_user.posts.select_related('user', 'user__profile').prefetch_related('likes', 'comments').all().order_by('-created_at')
-    if not is_owner and not is_friend:
-        # Only show public posts if not owner and not friend?
-        # Requirement: "other user can ... also implement this feature in other user profile"
-        # Assuming typical logic: Friends might see friends-only posts if we implemented that visibility.
-        # But for now, we only have 'public' and 'private'. 'private' usually means ONLY ME.
-        # Let's keep logic: if not owner, only public.
-        posts = posts.filter(visibility='public')
-    elif is_friend:
-        # If friend, maybe see more? For now, let's show public only unless visibility 'friends' exists (it doesn't yet).
-        # Actually in models.py: ('public', 'Public'), ('private', 'Private').
-        # So 'private' is strictly private. Friends see public.
-        posts = posts.filter(visibility='public')
-        
-    photos = posts.exclude(image='')
-    videos = posts.exclude(video='')
+        elif profile_user.id in pending:
+            request_received = True
+            request_received_id = pending[profile_user.id]
+
+    posts = with_card_relations(_visible_posts(profile_user, request.user)).order_by('-created_at', '-id')
+    # Counts and the sidebar's latest photos come from the cached summary; the
+    # photos/videos tabs load page by page from profile_media_page
+    summary = profile_summary.summary(profile_user.id, include_private=is_owner)
+    latest_photos = Post.objects.in_bulk(summary['latest_photos'])
     
     context = {
         'profile_user': profile_user,
-        'posts': posts,
-        'photos': photos,
-        'videos': videos,
+        'posts': hydrate_posts(posts, request.user),
+        'summary': summary,
+        'latest_photos': [latest_photos[pid] for pid in summary['latest_photos'] if pid in latest_photos],
         'is_owner': is_owner,
         'is_friend': is_friend,
+        'mutual_friends': mutual_friends,
         'request_sent': request_sent,
         'request_received': request_received,
         'request_received_id': request_received_id,
@@ -91,92 +92,139 @@ def profile_view(request, username):
     }
     return render(request, 'core/profile.html', context)
 
+def _visible_posts(profile_user, viewer):
+    # 'private' means only me, so friends and everyone else see public posts
+    posts = profile_user.posts.all()
+    if viewer != profile_user:
+        posts = posts.filter(visibility='public')
+    return posts
+
+@login_required
+def profile_media_page(request, username, kind):
+    # Lazy photos/videos tabs: next keyset page of the user's media posts as an HTML fragment
+    field = MEDIA_FILTERS.get(kind)
+    if not field:
+        raise Http404('Unknown media type')
+    profile_user = get_object_or_404(User, username=username)
+    try:
+        limit = int(request.GET.get('limit', MEDIA_PAGE_SIZE))
+    except ValueError:
+        limit = MEDIA_PAGE_SIZE
+
+    posts = _visible_posts(profile_user, request.user).exclude(**{field: ''})
+    posts, next_cursor = paginate_posts(posts, cursor=request.GET.get('cursor'), limit=limit)
+    html = render_to_string('core/partials/media_grid.html', {
+        'posts': posts, 'kind': kind, 'first_page': not request.GET.get('cursor'),
+    }, request=request)
+    return JsonResponse({'status': 'success', 'html': html, 'next_cursor': next_cursor})
+
 @login_required
 def search_view(request):
     query = request.GET.get('q', '')
     filter_type = request.GET.get('type', 'all') # Default to all
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
     
     users = []
     posts = []
+    has_next = False
     
     if query:
-        # Base Queries
-        user_query = Q(username__icontains=query) | Q(profile__bio__icontains=query)
-        post_query = Q(content__icontains=query, visibility='public')
-        
+        # Ranked full-text matches from core.search, one page per tab
         if filter_type == 'all':
-            users = User.objects.filter(user_query).exclude(id=request.user.id)[:5] # Limit for overview
-            posts = Post.objects.filter(post_query)[:10]
+            users, _ = search_users(query, exclude_id=request.user.id, limit=5) # Limit for overview
+            posts, _ = search_posts(query, limit=10)
             
         elif filter_type == 'people':
-            users = User.objects.filter(user_query).exclude(id=request.user.id)
+            users, has_next = search_users(query, exclude_id=request.user.id, page=page)
         
-        elif filter_type == 'posts':
-            posts = Post.objects.filter(post_query)
-            
-        elif filter_type == 'photos':
-            posts = Post.objects.filter(post_query).exclude(image='')
-            
-        elif filter_type == 'videos':
-            posts = Post.objects.filter(post_query).exclude(video='')
+        elif filter_type in MEDIA_FILTERS:
+            posts, has_next = search_posts(query, kind=filter_type, page=page)
+
+        posts = hydrate_posts(posts, request.user)
             
     context = {
         'query': query,
         'filter_type': filter_type,
         'users': users,
         'posts': posts,
+        'page': page,
+        'has_next': has_next,
     }
     return render(request, 'core/search.html', context)
 
+@login_required
+def search_suggest(request):
+    # Typeahead for the search box / @mentions; answered from memory, no queries
+    matches = usernames.suggest(request.GET.get('q', '').strip().lstrip('@'))
+    return JsonResponse({
+        'status': 'success',
+        'results': [{'username': name, 'url': reverse('profile', args=[name])} for _, name in matches],
+    })
+
 @login_required
 def chat_view(request, username=None):
-    # Get all users who have exchanged messages with current user, ordered by latest message
-    # This involves a bit of complex query logic, so we'll simplify for MVP:
-    # Get all friends + anyone we have messages with
-    
-    # 1. Get querysets of people I sent to or received from
-    sent_to = Message.objects.filter(sender=request.user).values_list('receiver', flat=True)
-    received_from = Message.objects.filter(receiver=request.user).values_list('sender', flat=True)
-    
-    # Combined set of user IDs
-    chat_user_ids = set(list(sent_to) + list(received_from))
-    
-    chat_users = User.objects.filter(id__in=chat_user_ids).exclude(id=request.user.id)
-    
-    # Annotate with unread status
-    unread_subquery = Message.objects.filter(
-        sender=OuterRef('pk'),
-        receiver=request.user,
-        is_read=False
-    )
-    chat_users = chat_users.annotate(has_unread=Exists(unread_subquery))
-    
     # If a specific user is selected (e.g. clicked 'Message' on profile)
     active_user = None
     chat_messages = []
+    has_older_messages = False
     
     if username:
         active_user = get_object_or_404(User, username=username)
-        # Mark as read
-        Message.objects.filter(sender=active_user, receiver=request.user, is_read=False).update(is_read=True)
-        # Get history
-        chat_messages = Message.objects.filter(
-        (Q(sender=request.user) & Q(receiver=active_user)) | 
-        (Q(sender=active_user) & Q(receiver=request.user))
-    ).select_related('sender', 'sender__profile', 'receiver', 'receiver__profile').order_by('timestamp')
-        
-        # If this implies a new chat with someone not in list, add them temporarily for UI
-        if active_user not in chat_users:
-            pass 
+        conversation = Conversation.between(request.user.id, active_user.id, create=False)
+        if conversation:
+            # Only the latest page; older messages load on scroll via chat_history_ajax
+            chat_messages, has_older_messages = history_page(conversation.id)
+        # Advance the read cursor to the newest message rendered (high-water mark),
+        # so a message arriving meanwhile is still delivered by get_messages_ajax
+        if chat_messages:
+            mark_read(conversation.id, request.user.id, chat_messages[-1].id)
+            realtime.push_unread_count(request.user.id)
+
+    # Sidebar: first page of my conversations, most recent first (one indexed query);
+    # loaded after marking read so the open chat doesn't show as unread
+    inbox, inbox_next_cursor = inbox_page(request.user.id)
 
     context = {
-        'chat_users': chat_users,
+        'inbox': inbox,
+        'inbox_next_cursor': inbox_next_cursor,
         'active_user': active_user,
         'chat_messages': chat_messages,
+        'has_older_messages': has_older_messages,
         'is_active_user_online': active_user.profile.is_online if active_user else False
     }
     return render(request, 'core/chat.html', context)
 
+@login_required
+def inbox_page_ajax(request):
+    # "Load more" for the chat sidebar
+    entries, next_cursor = inbox_page(request.user.id, cursor=request.GET.get('cursor'))
+    html = render_to_string('core/partials/inbox_list.html', {'inbox': entries}, request=request)
+    return JsonResponse({'status': 'success', 'html': html, 'next_cursor': next_cursor})
+
+@login_required
+def chat_history_ajax(request, username):
+    # Scroll-back: the page of messages just before ?before=<message id>
+    other_user = get_object_or_404(User, username=username)
+    conversation = Conversation.between(request.user.id, other_user.id, create=False)
+    try:
+        before_id = int(request.GET['before'])
+    except (KeyError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Missing before'}, status=400)
+    if conversation is None:
+        return JsonResponse({'status': 'success', 'html': '', 'has_more': False, 'oldest_id': None})
+
+    chat_messages, has_more = history_page(conversation.id, before_id=before_id)
+    html = render_to_string('core/partials/chat_message_list.html', {'chat_messages': chat_messages}, request=request)
+    return JsonResponse({
+        'status': 'success',
+        'html': html,
+        'has_more': has_more,
+        'oldest_id': chat_messages[0].id if chat_messages else None,
+    })
+
 @login_required
 def send_message_ajax(request):
     if request.method == 'POST':
@@ -191,35 +239,122 @@ def send_message_ajax(request):
             
         try:
             to_user = User.objects.get(username=to_username)
-            msg = Message.objects.create(sender=request.user, receiver=to_user, content=content, file=file)
-            
-            response_data = {
-                'status': 'success',
-                'timestamp': msg.timestamp.strftime('%H:%M'),
-                'content': msg.content
-            }
-            if msg.file:
-                response_data['file_url'] = msg.file.url
-                response_data['is_image'] = msg.file.name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp'))
-                response_data['file_name'] = msg.file.name.split('/')[-1]
-
-            return JsonResponse(response_data)
+            msg = Message.objects.create(
+                sender=request.user, receiver=to_user, content=content, file=file, file_name=file.name[:255] if file else '',
+            )
+            return JsonResponse(_message_sent(msg))
         except User.DoesNotExist:
              return JsonResponse({'status': 'error', 'message': 'User not found'})
              
     return JsonResponse({'status': 'error'})
 
+def _message_sent(msg):
+    # Notify the receiver and build the JSON the chat page expects back
+    realtime.push_message(msg)
+    realtime.push_unread_count(msg.receiver_id)
+
+    response_data = {
+        'status': 'success',
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+        'content': msg.content
+    }
+    if msg.file:
+        response_data['file_url'] = msg.file.url
+        response_data['is_image'] = msg.file.name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp'))
+        response_data['file_name'] = msg.attachment_name
+    return response_data
+
+# Chunked uploads (see core.uploads): start, PUT chunks, complete
+
+@login_required
+def upload_start(request):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+    try:
+        size = int(request.POST.get('size', ''))
+        upload = uploads.start(
+            request.user, request.POST.get('purpose', ''), request.POST.get('filename', ''),
+            size, request.POST.get('checksum', ''),
+        )
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Missing size'}, status=400)
+    except uploads.UploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
+    return JsonResponse({
+        'status': 'success',
+        'upload_id': str(upload.id),
+        'chunk_size': uploads.CHUNK_SIZE,
+        'offset': upload.offset,
+    })
+
+@login_required
+def upload_chunk(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+    if request.method == 'GET':
+        # Resuming: where to carry on from
+        return JsonResponse({'status': 'success', 'offset': upload.offset, 'size': upload.size})
+    if request.method != 'PUT':
+        return JsonResponse({'status': 'error'}, status=405)
+
+    try:
+        offset, length, total = uploads.parse_content_range(request.headers.get('Content-Range'))
+        try:
+            content_length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise uploads.UploadError('Invalid Content-Length')
+        if total != upload.size or content_length != length:
+            raise uploads.UploadError('Content-Range does not match this upload')
+        # Reads the body in small pieces straight from the socket to disk
+        uploads.write_chunk(upload, offset, length, request, request.headers.get('X-Chunk-Checksum', ''))
+    except uploads.UploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e), 'offset': upload.offset}, status=e.status)
+    return JsonResponse({'status': 'success', 'offset': upload.offset, 'size': upload.size})
+
+@login_required
+def upload_complete(request, upload_id):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+    upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+    content = request.POST.get('content', '')
+
+    to_user = None
+    if upload.purpose == ChunkedUpload.MESSAGE_FILE:
+        to_user = User.objects.filter(username=request.POST.get('to_user')).first()
+        if to_user is None:
+            return JsonResponse({'status': 'error', 'message': 'User not found'}, status=400)
+
+    try:
+        name = uploads.complete(upload)
+    except uploads.UploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
+
+    if to_user is not None:
+        msg = Message.objects.create(
+            sender=request.user, receiver=to_user, content=content, file=name, file_name=upload.filename,
+        )
+        return JsonResponse(_message_sent(msg))
+
+    visibility = request.POST.get('visibility', 'public')
+    if visibility not in dict(Post.VISIBILITY_CHOICES):
+        visibility = 'public'
+    post = Post.objects.create(user=request.user, content=content, visibility=visibility, video=name)
+    return JsonResponse({'status': 'success', 'post_id': post.id, 'redirect': reverse('home')})
+
 @login_required
 def get_messages_ajax(request, username):
     other_user = get_object_or_404(User, username=username)
     
-    # Get unread messages
-    new_msgs = Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).order_by('timestamp')
+    conversation = Conversation.between(request.user.id, other_user.id, create=False)
+    if conversation is None:
+        return JsonResponse({'status': 'success', 'messages': []})
+
+    # Messages above my read cursor (the sender is other_user, so no per-row sender lookups)
+    new_msgs = list(unread_messages(conversation.id, request.user.id))
     
     data = []
     for m in new_msgs:
         item = {
-            'sender': m.sender.username,
+            'sender': other_user.username,
             'content': m.content,
             'timestamp': m.timestamp.strftime('%H:%M'),
             'type': 'received'
@@ -227,11 +362,15 @@ def get_messages_ajax(request, username):
         if m.file:
             item['file_url'] = m.file.url
             item['is_image'] = m.file.name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp'))
-            item['file_name'] = m.file.name.split('/')[-1]
+            item['file_name'] = m.attachment_name
             
         data.append(item)
-        m.is_read = True
-        m.save()
+
+    if new_msgs:
+        # Advancing the cursor is one row update; anything that arrived after
+        # the SELECT has a higher id, stays unread and comes with the next fetch
+        mark_read(conversation.id, request.user.id, new_msgs[-1].id)
+        realtime.push_unread_count(request.user.id)
         
     return JsonResponse({'status': 'success', 'messages': data})
 
@@ -291,20 +430,11 @@ def home(request):
         post = Post(user=request.user, content=content, visibility=visibility)
         
         if 'image' in request.FILES:
-            print(f"DEBUG: Image found in request.FILES: {request.FILES['image']}")
             post.image = request.FILES['image']
-        else:
-            print("DEBUG: No image in request.FILES")
-
         if 'video' in request.FILES:
             post.video = request.FILES['video']
-                
-        post.save()
-        if post.image:
-             print(f"DEBUG: Post saved with image URL: {post.image.url}")
-        else:
-             print("DEBUG: Post saved WITHOUT image")
 
+        post.save()
         messages.success(request, 'Post created!')
         return redirect('home')
 
@@ -317,26 +447,43 @@ def home(request):
         post = get_object_or_404(Post, id=post_id)
         if content:
             Comment.objects.create(user=request.user, post=post, content=content)
+            bump(post.id, 'comment_count')
         return redirect('home')
 
-    posts = Post.objects.filter(visibility='public') 
-    own_posts = Post.objects.filter(user=request.user, visibility='private')
-    all_posts = (posts | own_posts).distinct().order_by('-created_at')
-    
-    return render(request, 'core/feed.html', {'posts': all_posts})
+    posts, next_cursor = timeline.home_page(request.user)
+    hydrate_posts(posts, request.user)
+
+    return render(request, 'core/feed.html', {'posts': posts, 'next_cursor': next_cursor})
+
+@login_required
+def feed_page(request):
+    # Infinite scroll endpoint: next keyset page of the home feed as an HTML fragment
+    try:
+        limit = int(request.GET.get('limit', FEED_PAGE_SIZE))
+    except ValueError:
+        limit = FEED_PAGE_SIZE
+
+    posts, next_cursor = timeline.home_page(request.user, cursor=request.GET.get('cursor'), limit=limit)
+    hydrate_posts(posts, request.user)
+    html = render_to_string('core/partials/post_list.html', {'posts': posts}, request=request)
+    return JsonResponse({'status': 'success', 'html': html, 'next_cursor': next_cursor})
 
 @login_required
 def like_post_view(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    if request.user in post.likes.all():
-        post.likes.remove(request.user)
-        liked = False
-    else:
-        post.likes.add(request.user)
-        liked = True
-        
+    like = Post.likes.through
+    with transaction.atomic():
+        # Toggle on the rows themselves, and count them rather than bumping
+        # by one: a double-click sends two toggles that can both see "not liked"
+        removed, _ = like.objects.filter(post_id=post.id, user_id=request.user.id).delete()
+        liked = not removed
+        if liked:
+            like.objects.bulk_create([like(post_id=post.id, user_id=request.user.id)], ignore_conflicts=True)
+        recount_likes(post.id)
+
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        return JsonResponse({'liked': liked, 'count': post.likes.count()})
+        post.refresh_from_db(fields=['like_count'])
+        return JsonResponse({'liked': liked, 'count': post.like_count})
         
     return redirect(request.META.get('HTTP_REFERER', 'home'))
 
@@ -348,15 +495,28 @@ def add_comment_ajax(request):
         post = get_object_or_404(Post, id=post_id)
         if content:
             comment = Comment.objects.create(user=request.user, post=post, content=content)
+            bump(post.id, 'comment_count')
+            post.refresh_from_db(fields=['comment_count'])
             return JsonResponse({
                 'status': 'success',
                 'username': request.user.username,
                 'profile_url': request.user.profile.get_profile_picture_url,
                 'content': comment.content,
-                'count': post.comments.count()
+                'count': post.comment_count
             })
     return JsonResponse({'status': 'error'})
 
+@login_required
+def post_comments_ajax(request, post_id):
+    # Full comment thread for a post; cards only render a short preview
+    post = get_object_or_404(Post, id=post_id)
+    if post.visibility == 'private' and post.user != request.user:
+        return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
+
+    comments = list(post.comments.select_related('user__profile').order_by('created_at', 'id'))
+    html = render_to_string('core/partials/comment_list.html', {'comments': comments}, request=request)
+    return JsonResponse({'status': 'success', 'html': html, 'count': len(comments)})
+
 @login_required
 def edit_post_view(request, post_id):
     post = get_object_or_404(Post, id=post_id)
@@ -366,7 +526,13 @@ def edit_post_view(request, post_id):
     if request.method == 'POST':
         form = PostForm(request.POST, request.FILES, instance=post)
         if form.is_valid():
-            form.save()
+            # Only write the edited fields, then bump the version in the database:
+            # saving the row we read could undo a concurrent bump (or new image
+            # variants) from generate_post_variants
+            post = form.save(commit=False)
+            post.save(update_fields=PostForm.Meta.fields)
+            Post.objects.filter(id=post.id).update(version=F('version') + 1)
+            post.refresh_from_db(fields=['version'])
             messages.success(request, 'Post updated!')
             return redirect('home')
     else:
@@ -405,6 +571,7 @@ def share_post_view(request, post_id):
             shared_post=target_post,
             visibility='public' 
         )
+        bump(target_post.id, 'share_count')
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=400)
 
@@ -414,26 +581,21 @@ def friends_view(request):
     friend_requests = FriendRequest.objects.filter(to_user=request.user)
     
     # Current Friends
-    friends = request.user.profile.friends.all()
-    
-    # Simple Suggestion Logic: Users who are NOT me, NOT my friends, and NOT in pending requests
-    # 1. Get all users excluding self
-    all_users = User.objects.exclude(id=request.user.id)
-    
-    # 2. Exclude current friends
-    # Note: friends is a queryset of Users
-    all_users = all_users.exclude(id__in=friends.values_list('id', flat=True))
+    friends = request.user.profile.friends.select_related('profile')
     
-    # 3. Exclude users I've sent requests to OR received from
-    sent_to_ids = FriendRequest.objects.filter(from_user=request.user).values_list('to_user_id', flat=True)
-    received_from_ids = FriendRequest.objects.filter(to_user=request.user).values_list('from_user_id', flat=True)
-    
-    suggestions = all_users.exclude(id__in=sent_to_ids).exclude(id__in=received_from_ids)
+    # People you may know: friends of friends ranked by mutual friends (cached)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    suggestions, has_more_suggestions = recommendations.suggestions_page(request.user.id, page)
     
     return render(request, 'core/friends.html', {
         'friend_requests': friend_requests,
         'friends': friends,
-        'suggestions': suggestions
+        'suggestions': suggestions,
+        'suggestions_page': page,
+        'has_more_suggestions': has_more_suggestions,
     })
 
 @login_required
@@ -443,7 +605,7 @@ def send_friend_request(request, username):
         return JsonResponse({'status': 'error', 'message': 'Cannot add yourself'})
         
     # Check if already friends
-    if to_user in request.user.profile.friends.all():
+    if graph.are_friends(request.user.id, to_user.id):
         return JsonResponse({'status': 'error', 'message': 'Already friends'})
         
     # Check if request already sent
@@ -452,6 +614,8 @@ def send_friend_request(request, username):
     
     # Create request
     FriendRequest.objects.create(from_user=request.user, to_user=to_user)
+    recommendations.invalidate(request.user.id, to_user.id)
+    realtime.push_friend_request_count(to_user.id)
     return JsonResponse({'status': 'success', 'message': 'Friend request sent'})
 
 @login_required
@@ -460,11 +624,13 @@ def accept_friend_request(request, request_id):
     if freq.to_user != request.user:
         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
         
-    # Add to friends (Both ways)
-    request.user.profile.friends.add(freq.from_user)
-    freq.from_user.profile.friends.add(request.user)
-    
-    freq.delete()
+    # One friendship row covers both directions
+    with transaction.atomic():
+        Friendship.befriend(request.user.id, freq.from_user_id)
+        freq.delete()
+        timeline.backfill_pair.delay(request.user.id, freq.from_user_id)
+    recommendations.invalidate(request.user.id, freq.from_user_id)
+    realtime.push_friend_request_count(request.user.id)
     return JsonResponse({'status': 'success', 'message': 'Friend request accepted'})
 
 @login_required
@@ -474,15 +640,17 @@ def reject_friend_request(request, request_id):
         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
         
     freq.delete()
+    recommendations.invalidate(request.user.id, freq.from_user_id)
+    realtime.push_friend_request_count(request.user.id)
     return JsonResponse({'status': 'success', 'message': 'Friend request rejected'})
 
 @login_required
 def remove_friend(request, username):
     other_user = get_object_or_404(User, username=username)
     
-    if other_user in request.user.profile.friends.all():
-        request.user.profile.friends.remove(other_user)
-        other_user.profile.friends.remove(request.user)
+    if Friendship.unfriend(request.user.id, other_user.id):
+        timeline.remove_pair.delay(request.user.id, other_user.id)
+        recommendations.invalidate(request.user.id, other_user.id)
         return JsonResponse({'status': 'success', 'message': 'Friend removed'})
         
     return JsonResponse({'status': 'error', 'message': 'Not friends'})
@@ -542,72 +710,54 @@ def update_bio_view(request):
     return redirect('profile', username=request.user.username)
 @login_required
 def get_unread_count(request):
-    # Count unique users who sent unread messages
-    count = Message.objects.filter(receiver=request.user, is_read=False).values('sender').distinct().count()
-    return JsonResponse({'count': count})
+    return JsonResponse({'count': realtime.unread_count(request.user.id)})
 
 @login_required
 def get_friend_request_count(request):
-    count = FriendRequest.objects.filter(to_user=request.user).count()
-    return JsonResponse({'count': count})
+    return JsonResponse({'count': realtime.friend_request_count(request.user.id)})
 
-import os
-import re
-import mimetypes
-from django.http import StreamingHttpResponse, Http404, HttpResponse
-from django.conf import settings
-
-def stream_video(request, path):
+async def event_stream(request):
     """
-    Stream video file supporting Range header for partial content (206).
+    Server-Sent Events feed of chat nudges and badge counts for the current user.
+    Needs the ASGI app; under WSGI it answers 204 so the client keeps polling.
     """
-    file_path = os.path.join(settings.MEDIA_ROOT, path)
-    
-    if not os.path.exists(file_path):
-        raise Http404("Video not found")
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
 
-    file_size = os.path.getsize(file_path)
-    content_type, _ = mimetypes.guess_type(file_path)
-    content_type = content_type or 'application/octet-stream'
+    user_id = await sync_to_async(lambda: request.user.id if request.user.is_authenticated else None)()
+    if user_id is None:
+        return HttpResponse(status=401)
 
-    range_header = request.headers.get('Range', '').strip()
-    range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+    broker = realtime.get_broker()
 
-    if range_match:
-        first_byte, last_byte = range_match.groups()
-        first_byte = int(first_byte) if first_byte else 0
-        last_byte = int(last_byte) if last_byte else file_size - 1
-        
-        if last_byte >= file_size:
-            last_byte = file_size - 1
-        
-        length = last_byte - first_byte + 1
-        
-        def file_iterator(file_path, offset=0, length=None, chunk_size=8192):
-            with open(file_path, 'rb') as f:
-                f.seek(offset, os.SEEK_SET)
-                remaining = length
-                while remaining > 0:
-                    read_size = min(chunk_size, remaining)
-                    data = f.read(read_size)
-                    if not data:
-                        break
-                    remaining -= len(data)
-                    yield data
-
-        response = StreamingHttpResponse(
-            file_iterator(file_path, offset=first_byte, length=length),
-            status=206,
-            content_type=content_type
-        )
-        response['Content-Range'] = f'bytes {first_byte}-{last_byte}/{file_size}'
-        response['Content-Length'] = str(length)
-        response['Accept-Ranges'] = 'bytes'
-    else:
-        # If no range header, return the full file (or maybe just a standard serve?)
-        # For simplicity in this 'stream' view, we return full content but setup accept-ranges
-        response = HttpResponse(open(file_path, 'rb'), content_type=content_type)
-        response['Content-Length'] = str(file_size)
-        response['Accept-Ranges'] = 'bytes'
-        
+    async def stream():
+        # Subscribed here, not in the view, so a response that is never iterated
+        # (client gone before the first chunk) never leaves a queue behind
+        queue = broker.subscribe(user_id)
+        try:
+            yield 'retry: 5000\n\n'
+            # Initial snapshot so badges are right as soon as the stream opens
+            unread = await sync_to_async(realtime.unread_count)(user_id)
+            requests_count = await sync_to_async(realtime.friend_request_count)(user_id)
+            yield realtime.format_event('unread_count', {'count': unread})
+            yield realtime.format_event('friend_request_count', {'count': requests_count})
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=REALTIME_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield realtime.format_event(event, data)
+        finally:
+            broker.unsubscribe(user_id, queue)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
     return response
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file with long-lived caching and Range support; see core.media.
+    """
+    return media.serve_file(request, path)
@@ -3,6 +3,10 @@ ASGI config for social_platform project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The realtime /events/ stream only pushes when served through this module,
+e.g. ``gunicorn social_platform.asgi:application -k uvicorn.workers.UvicornWorker``;
+under WSGI clients fall back to polling.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
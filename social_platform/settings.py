@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -26,6 +27,9 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-4*3v%8g)b2f$#5rla^jvz
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# `manage.py test`: keeps tests off the real cache directory and background threads
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 ALLOWED_HOSTS = ['*']
 CSRF_TRUSTED_ORIGINS = ['https://' + host for host in ALLOWED_HOSTS if host != '*'] + ['http://localhost:8000', 'http://127.0.0.1:8000']
 
@@ -86,6 +90,37 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The default cache is a per-process LRU (core.caching.TieredCache) in front of
+# the 'shared' cache every worker sees; LOCAL_TIMEOUT is how many seconds a
+# worker may serve a value another worker has since changed. 'shared' must be
+# seen by every worker process (Passenger runs several) and have an atomic
+# add() (locks and namespace versions rely on it): Redis when REDIS_URL is
+# set, otherwise a DatabaseCache table (created by migration 0016). Tests get
+# their own LocMemCache.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if TESTING:
+    SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared',
+                    'OPTIONS': {'MAX_ENTRIES': 10000}}
+elif REDIS_URL:
+    SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}
+else:
+    SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'core_cache',
+                    'OPTIONS': {'MAX_ENTRIES': 10000}}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'core.caching.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {'SHARED': 'shared', 'MAX_ENTRIES': 1000, 'LOCAL_TIMEOUT': 5},
+    },
+    'shared': SHARED_CACHE,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -125,8 +160,9 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 STORAGES = {
+    # Stores each upload once under its content hash (deduplicated, cacheable forever)
     "default": {
-        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "BACKEND": "core.storage.ContentAddressedStorage",
     },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedStaticFilesStorage",
@@ -136,6 +172,15 @@ STORAGES = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Let the front proxy send media bytes: 'x-accel-redirect' (nginx, with an
+# internal location at MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT) or
+# 'x-sendfile' (Apache/lighttpd). None streams from Django via sendfile.
+MEDIA_OFFLOAD = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Browser cache lifetime for media saved before content-addressed blobs
+# (blob names are cached for a year as immutable)
+MEDIA_CACHE_MAX_AGE = 60 * 60
+
 # Default primary key field type
 
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -146,6 +191,57 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Presence: seconds between cached "last seen" updates and between
+# Profile.last_activity writes per user, and how often / how many buffered
+# writes are flushed together
+PRESENCE_SEEN_INTERVAL = 30
+PRESENCE_WRITE_INTERVAL = 60
+PRESENCE_FLUSH_INTERVAL = 10
+PRESENCE_FLUSH_BATCH_SIZE = 100
+# Also flush from a timer thread and at exit, so idle workers don't lose writes
+PRESENCE_BACKGROUND_FLUSH = not TESTING
+
+# Pub/sub used by the /events/ SSE stream (served only under ASGI). The
+# in-process broker is enough for a single ASGI worker.
+REALTIME_BROKER = 'core.realtime.InProcessBroker'
+
+# Full-text search. The FTS5 backend needs SQLite; use
+# 'core.search.LikeBackend' on other databases.
+SEARCH_BACKEND = 'core.search.SQLiteFTSBackend'
+
+# Seconds between background reloads of the in-memory username typeahead
+# index (edits in this process are applied immediately via signals)
+SUGGEST_REFRESH_INTERVAL = 300
+
+# Seconds a user's cached "people you may know" list lives; friendship and
+# friend-request changes clear it for both users straight away
+SUGGESTION_CACHE_TIMEOUT = 60 * 60
+
+# Seconds a user's cached friend-id set lives (friendship changes clear it)
+SOCIAL_GRAPH_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Background jobs (core.tasks), run by `manage.py run_worker`. In eager mode
+# (on under tests, or with TASKS_EAGER=1) tasks run inline and no worker is
+# needed. Past MAX_DEPTH queued jobs, tasks also run inline to push back on
+# producers.
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '1' if TESTING else '0') == '1'
+TASK_QUEUE_MAX_DEPTH = 10000
+TASK_LOCK_TIMEOUT = 10 * 60
+
+# Home timelines: new posts are copied into each friend's timeline by a
+# background job. Timelines keep the newest MAX_LENGTH posts; authors with
+# more than FANOUT_LIMIT friends aren't copied (home merges in the public feed
+# on read, which covers them).
+TIMELINE_MAX_LENGTH = 800
+TIMELINE_FANOUT_LIMIT = 5000
+
+# Chunked uploads (core.uploads) for post videos and chat files: the largest
+# chunk one PUT may carry, the largest file, and how long an unfinished
+# upload is kept before `manage.py purge_uploads` removes it
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+UPLOAD_EXPIRY = 24 * 60 * 60
+
 # Production Security Settings - Commented out for Development
 # if not DEBUG:
 #     SECURE_SSL_REDIRECT = True
@@ -1,22 +1,11 @@
-from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include, re_path
-from core.views import stream_video
+from core.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    # Intercept video requests for streaming
-    re_path(r'^media/(?P<path>.*\.(mp4|webm|mov|mkv))$', stream_video),
+    # Uploaded media: cache headers, ranges and optional proxy offload (core.media).
+    # Static files are served by WhiteNoise's middleware.
+    re_path(r'^media/(?P<path>.+)$', serve_media),
     path('', include('core.urls')),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-else:
-    from django.views.static import serve
-    from django.urls import re_path
-    
-    urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-    ]